@@ -4,8 +4,14 @@ from .vis import *
 from .utils import prepare_path
 from .rollout_worker import ArenaRolloutWorker
 
+import ray.rllib.evaluation.worker_set
 from ray.tune.registry import register_env
 
+# rollout workers are ArenaRolloutWorker, which steps the envs of a worker concurrently.
+# Tune builds each trainer in its own process, where WorkerSet creates the workers,
+# the patch is done here since that process imports arena when unpickling the env creators registered below
+ray.rllib.evaluation.worker_set.RolloutWorker = ArenaRolloutWorker
+
 env_ids = [
     "Arena-Tennis-Sparse-2T1P-Discrete",
     "Arena-BarrierGunner-3X3-PT-Sparse-2T1P-Discrete",
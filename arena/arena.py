@@ -13,7 +13,7 @@ import numpy as np
 from .utils import *
 from .constants import *
 
-from .envs import ArenaRllibEnv, is_arena_env
+from .envs import ArenaRllibEnv, is_arena_env, get_spaces_cache_key
 from .models import DeterministicCategorical
 from .arguments import create_parser, override_exps_to_dummy, override_exps_to_eval
 
@@ -192,10 +192,41 @@ def get_possible_iteration_indexes(logdir, population_i):
     return possible_iteration_indexes, possible_iterations
 
 
+def drain_worker_latency_histograms(worker):
+    """Drain the latency histograms of the arena envs of a rollout worker.
+    The envs of remote_worker_envs live in other processes, so they are not covered.
+    """
+    return merge_latency_histograms([
+        env.drain_latency_histograms() for env in worker.async_env.get_unwrapped() if isinstance(env, ArenaRllibEnv)
+    ])
+
+
+def report_latency_quantiles(info):
+    """Report quantiles of the latencies of arena envs of all rollout workers in this iteration,
+    merged into one histogram per stage, as custom metrics (in ms) of the result
+    """
+
+    latency_histograms = merge_latency_histograms(
+        info["trainer"].workers.foreach_worker(
+            drain_worker_latency_histograms
+        )
+    )
+
+    custom_metrics = info["result"].setdefault("custom_metrics", {})
+    for name, histogram in latency_histograms.items():
+        for quantile in LATENCY_QUANTILES:
+            custom_metrics["latency_{}_p{}_ms".format(
+                name,
+                int(quantile * 100),
+            )] = 1000.0 * histogram.quantile(quantile)
+
+
 def on_train_result(info):
     """Function called after each trained iteration
     """
 
+    report_latency_quantiles(info)
+
     if info["result"]["training_iteration"] % info["trainer"].config["iterations_per_reload"] == 0:
 
         logger.info(
@@ -396,6 +427,7 @@ def preprocess_config_value_this_level(running_config, config_key_this_level, co
 
 def get_env_infos(env, env_config):
     """Create dummy_env to get env_infos of env as a dict.
+    For arena env, env_infos are cached on disk, keyed by env, the game build and the env_config that determines the spaces.
 
     Arguments:
         env: id of env
@@ -407,6 +439,14 @@ def get_env_infos(env, env_config):
     env_infos = {}
 
     if is_arena_env(env):
+        # env_infos of arena env are cached on disk, so that they are obtained without launching the game next time
+        cache_key = get_spaces_cache_key(env, env_config)
+        cached_env_infos = load_metadata_cache("env_infos", cache_key)
+        if cached_env_infos is not None:
+            logger.info("Loaded env_infos of {} from cache.".format(
+                env,
+            ))
+            return cached_env_infos
         dummy_env = ArenaRllibEnv(
             env=env,
             env_config=env_config,
@@ -424,9 +464,16 @@ def get_env_infos(env, env_config):
     env_infos["act_space"] = dcopy(
         dummy_env.action_space
     )
+    if is_arena_env(env) and dummy_env.is_flatten_obs:
+        env_infos["flat_obs_offsets"] = dcopy(
+            dummy_env.flat_obs_offsets
+        )
 
     dummy_env.close()
 
+    if is_arena_env(env):
+        save_metadata_cache("env_infos", cache_key, env_infos)
+
     return env_infos
 
 
@@ -471,13 +518,27 @@ def expand_exp(config_to_expand, config_keys_to_expand, args=None, parser=None,
 
             # if is arena env
 
+            # process expanded_exp["config"]["env_config"]["obs_buffers_depth"]
+            if expanded_exp["config"]["env_config"].get("is_reuse_obs_buffers", False):
+                if expanded_exp["config"].get("batch_mode", "truncate_episodes") not in ["truncate_episodes"]:
+                    raise Exception(
+                        "is_reuse_obs_buffers requires batch_mode=truncate_episodes, " +
+                        "otherwise rllib may hold an obs for an unbounded number of steps."
+                    )
+                # rllib holds an obs for at most sample_batch_size steps before copying it into a sample batch,
+                # plus the last obs of the episode and the one being returned
+                expanded_exp["config"]["env_config"]["obs_buffers_depth"] = expanded_exp["config"].get(
+                    "sample_batch_size", 200
+                ) + 2
+
             # update expanded_exp["config"] with infos of env
-            expanded_exp["config"].update(
-                get_env_infos(
-                    env=expanded_exp["env"],
-                    env_config=expanded_exp["config"]["env_config"],
-                )
+            env_infos = get_env_infos(
+                env=expanded_exp["env"],
+                env_config=expanded_exp["config"]["env_config"],
             )
+            # flat_obs_offsets is passed to the model in custom_options, instead of config
+            flat_obs_offsets = env_infos.pop("flat_obs_offsets", None)
+            expanded_exp["config"].update(env_infos)
 
             # process expanded_exp["config"]["num_learning_policies"]
             if isinstance(expanded_exp["config"]["num_learning_policies"], str):
@@ -592,6 +653,27 @@ def expand_exp(config_to_expand, config_keys_to_expand, args=None, parser=None,
             else:
                 raise ValueError
 
+            # process expanded_exp["config"]["env_config"]["is_uint8_visual"]
+            is_uint8_obs_space = False
+            if expanded_exp["config"]["env_config"].get("is_uint8_visual", False):
+                if isinstance(expanded_exp["config"]["obs_space"], gym.spaces.Dict):
+                    obs_spaces_per_key = list(
+                        expanded_exp["config"]["obs_space"].spaces.values()
+                    )
+                    for obs_space_per_key in obs_spaces_per_key:
+                        if isinstance(obs_space_per_key, gym.spaces.Dict):
+                            # multi_agent_ob in the compact form (is_compact_multi_agent_obs)
+                            obs_spaces_per_key += list(
+                                obs_space_per_key.spaces.values()
+                            )
+                        elif obs_space_per_key.dtype == np.uint8:
+                            raise Exception(
+                                "is_uint8_visual does not support a visual sensor combined with other observations, " +
+                                "since rllib flattens them into one float observation."
+                            )
+                elif expanded_exp["config"]["obs_space"].dtype == np.uint8:
+                    is_uint8_obs_space = True
+
             # apply configs of all policies
             for policy_i in range(expanded_exp["config"]["number_agents"]):
 
@@ -628,6 +710,25 @@ def expand_exp(config_to_expand, config_keys_to_expand, args=None, parser=None,
                             ),
                         }
 
+                # uint8 visual observations are normalized in ArenaVisionNetwork
+                if is_uint8_obs_space:
+
+                    if "model" in policy_config.keys():
+                        raise Exception(
+                            "is_uint8_visual is not supported by ArenaPolicy yet."
+                        )
+
+                    policy_config["model"] = {}
+                    policy_config["model"]["custom_model"] = "ArenaVisionNetwork"
+
+                if flat_obs_offsets is not None:
+
+                    # pass custom_options for is_flatten_obs to whichever model is used,
+                    # so that it can slice the flat obs with split_flat_obs (see get_obs_dict)
+                    policy_config.setdefault("model", {}).setdefault(
+                        "custom_options", {}
+                    )["flat_obs_offsets"] = dcopy(flat_obs_offsets)
+
                 if expanded_exp["run"] not in ["PPO"]:
                     # # TODO: currently only support PPO
                     raise NotImplementedError
@@ -178,6 +178,9 @@ def override_exps_to_eval(exps):
         exps[exp_key]["config"]["num_learning_policies"] = 0
         exps[exp_key]["config"]["env_config"]["train_mode"] = False
         exps[exp_key]["config"]["env_config"]["is_shuffle_agents"] = False
+        # eval samples complete_episodes, where an obs could be held for unbounded steps
+        exps[exp_key]["config"]["env_config"]["is_reuse_obs_buffers"] = False
+        exps[exp_key]["config"]["env_config"]["is_shared_memory_obs"] = False
 
     return exps
 
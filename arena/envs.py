@@ -1,19 +1,90 @@
+import time
+import fcntl
+import socket
+import tempfile
+import functools
+import threading
+import collections
+import psutil
+
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+
 from ray.rllib.env.multi_agent_env import MultiAgentEnv
+from ray.rllib.env.base_env import BaseEnv, _MultiAgentEnvToBaseEnv
+from ray.rllib.utils.annotations import override
+import gym_unity.envs
 from gym_unity.envs import UnityEnv
+from mlagents.envs.brain import BrainInfo
 from gym import error, spaces
 
 from .utils import *
 from .constants import *
+from .simulated import SimulatedUnityEnvironment
 
 logger = logging.getLogger(__name__)
 
 IS_AUTO_RESET = True
+# ranks (worker_id of UnityEnvironment, which listens at port 5005+rank) used by Arena games
+UNITY_RANK_MIN = 10000
+UNITY_RANK_MAX = 60000
+# ranks reserved for the envs of each rollout worker, indexed by vector_index
+UNITY_RANKS_PER_WORKER = 16
+# when a rank is taken, probe the rank UNITY_RANK_PROBE_STRIDE after it,
+# which is prime to (UNITY_RANK_MAX - UNITY_RANK_MIN) so that all ranks can be probed
+UNITY_RANK_PROBE_STRIDE = 1009
+UNITY_RANK_MAX_PROBES = 64
+# host-local registry of ranks in use, shared by all users since the ports are,
+# each rank is a lock file flock-ed by its owner (released by the kernel when the owner dies), holding the pid of the owner
+UNITY_RANKS_DIR = os.path.join(tempfile.gettempdir(), "arena-unity-ranks")
+UNITY_RANKS_DIR_MODE = 0o1777
+UNITY_RANK_LOCK_FILE_MODE = 0o666
+# fd of the lock file of each rank acquired by this process
+UNITY_RANK_LOCK_FDS = {}
+UNITY_RANK_LOCK_FDS_LOCK = threading.Lock()
+MAX_LAUNCH_RETRIES = 5
+# keys of env_config that determine observation_space and action_space of ArenaRllibEnv
+SPACES_ENV_CONFIG_KEYS = [
+    "sensors", "multi_agent_obs", "is_uint8_visual", "is_compact_multi_agent_obs", "is_flatten_obs",
+    "backend", "simulated_config",
+]
+# bump this when changing how ArenaRllibEnv builds its spaces, to invalidate cached spaces
+SPACES_CACHE_VERSION = 1
+MIN_OBS_BUFFERS_DEPTH = 2
+# host-local directory of the shared memory holding obs buffers of remote envs (is_shared_memory_obs),
+# one per user, each file is named by the pid of its owner and the id of the ArenaRllibEnv
+SHARED_MEMORY_DIR = os.path.join(
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+    "arena-shared-obs-{}".format(os.getuid()),
+)
+SHARED_MEMORY_ALIGNMENT = 64
+SHARED_MEMORY_HOSTNAME = socket.gethostname()
+# number of threads decoding the visual observations of each game instance, 0 to decode in the stepping thread
+DECODE_THREADS = 4
+# seconds a step or a reset of the game may take before the game is considered hung and relaunched,
+# 0 to disable the supervision of the game
+STEP_TIMEOUT = 60.0
+# seconds between checks if the game is still alive, while waiting for a step or a reset of it
+SUPERVISOR_POLL_INTERVAL = 1.0
+# relaunching a crashed game backs off for RELAUNCH_BACKOFF_MIN * 2 ** (consecutive relaunches - 1) seconds,
+# capped at max_relaunch_backoff, and gives up after max_relaunches consecutive relaunches
+RELAUNCH_BACKOFF_MIN = 1.0
+MAX_RELAUNCH_BACKOFF = 60.0
+MAX_RELAUNCHES = 5
+# recycle the game after this number of episodes, or once the resident memory of its process exceeds this number of MB,
+# by swapping in a standby game booted in the background, 0 to disable
+RECYCLE_EPISODES = 0
+RECYCLE_RSS_MB = 0
 VALID_SENSORS = ["visual_FP", "visual_TP", "vector"]
 SENSOR2CAMERA = {
     "visual_FP": 0,
     "visual_TP": 1,
 }
 CAMERA2SENSOR = dict([(value, key) for key, value in SENSOR2CAMERA.items()])
+VALID_INFOS_MODES = ["full", "slim", "none"]
+# unity: launch the game build; simulated: SimulatedUnityEnvironment (simulated.py) without launching a game
+VALID_BACKENDS = ["unity", "simulated"]
+# the UnityEnvironment of gym_unity.envs is swapped while creating an ArenaUnityEnv with the simulated backend
+SIMULATED_BACKEND_LOCK = threading.Lock()
 
 
 def _validate_sensors(sensors):
@@ -23,6 +94,332 @@ def _validate_sensors(sensors):
             raise Exception("sensor {} is invalid".format(sensor))
 
 
+def _validate_infos_mode(infos_mode):
+    if infos_mode not in VALID_INFOS_MODES:
+        raise Exception("infos_mode {} is invalid".format(infos_mode))
+
+
+def _validate_backend(backend):
+    if backend not in VALID_BACKENDS:
+        raise Exception("backend {} is invalid".format(backend))
+
+
+def get_preferred_unity_rank(env_config):
+    """Get the preferred rank of a game instance from worker_index and vector_index of env_config,
+    which is an EnvContext when created by rllib, or a dict otherwise.
+    """
+    worker_index = getattr(env_config, "worker_index", 0)
+    vector_index = getattr(env_config, "vector_index", 0)
+    return UNITY_RANK_MIN + (
+        worker_index * UNITY_RANKS_PER_WORKER + vector_index
+    ) % (UNITY_RANK_MAX - UNITY_RANK_MIN)
+
+
+def get_unity_rank_lock_file(rank):
+    return os.path.join(
+        UNITY_RANKS_DIR,
+        "{}.lock".format(rank),
+    )
+
+
+def _make_unity_ranks_dir():
+    """Create UNITY_RANKS_DIR writable by all users, with the sticky bit as /tmp.
+    """
+    os.makedirs(UNITY_RANKS_DIR, exist_ok=True)
+    try:
+        # makedirs is subject to the umask
+        os.chmod(UNITY_RANKS_DIR, UNITY_RANKS_DIR_MODE)
+    except PermissionError:
+        # created by another user
+        pass
+
+
+def _open_unity_rank_lock_file(lock_file):
+    """Open lock_file, creating it if it does not exist.
+    An existing one is opened without O_CREAT, which is refused for files of other users
+    in a sticky directory when fs.protected_regular is set.
+    """
+    while True:
+        try:
+            return os.open(lock_file, os.O_RDWR)
+        except FileNotFoundError:
+            pass
+        try:
+            return os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_RDWR, UNITY_RANK_LOCK_FILE_MODE)
+        except FileExistsError:
+            # created by another process in between
+            pass
+
+
+def _try_lock_unity_rank(rank):
+    try:
+        fd = _open_unity_rank_lock_file(get_unity_rank_lock_file(rank))
+    except PermissionError:
+        # a lock file of another user that is not writable by this user, consider the rank taken
+        return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return False
+    try:
+        # open is subject to the umask
+        os.fchmod(fd, UNITY_RANK_LOCK_FILE_MODE)
+    except PermissionError:
+        pass
+    # the pid is only for inspecting the registry, the flock is the lock
+    os.ftruncate(fd, 0)
+    os.write(fd, str(os.getpid()).encode())
+    with UNITY_RANK_LOCK_FDS_LOCK:
+        UNITY_RANK_LOCK_FDS[rank] = fd
+    return True
+
+
+def acquire_unity_rank(preferred_rank):
+    """Acquire a rank that is not used by any other game instance on this host,
+    probing from preferred_rank with a stride of UNITY_RANK_PROBE_STRIDE.
+    The acquired rank has to be released with release_unity_rank, or is released when this process dies.
+    """
+    _make_unity_ranks_dir()
+    for probe_i in range(UNITY_RANK_MAX_PROBES):
+        rank = UNITY_RANK_MIN + (
+            preferred_rank - UNITY_RANK_MIN + probe_i * UNITY_RANK_PROBE_STRIDE
+        ) % (UNITY_RANK_MAX - UNITY_RANK_MIN)
+        if _try_lock_unity_rank(rank):
+            return rank
+    error = "Cannot acquire a free rank after probing {} ranks from {}, check {}".format(
+        UNITY_RANK_MAX_PROBES,
+        preferred_rank,
+        UNITY_RANKS_DIR,
+    )
+    logger.error(error)
+    raise Exception(error)
+
+
+def release_unity_rank(rank):
+    """Release a rank acquired by this process with acquire_unity_rank.
+    The lock file is kept, removing it would race with other processes locking it.
+    """
+    with UNITY_RANK_LOCK_FDS_LOCK:
+        fd = UNITY_RANK_LOCK_FDS.pop(rank, None)
+    if fd is not None:
+        os.ftruncate(fd, 0)
+        # closing the fd releases the flock
+        os.close(fd)
+
+
+# handle to an obs in the shared memory, returned by remote ArenaRllibEnv instead of the obs (is_shared_memory_obs)
+SharedMemoryObs = collections.namedtuple(
+    "SharedMemoryObs", ["hostname", "path", "offset", "shape", "dtype"]
+)
+
+
+def _reclaim_stale_shared_memory():
+    """Remove the shared memory files of this user whose owner is dead.
+    """
+    for file_name in os.listdir(SHARED_MEMORY_DIR):
+        file_path = os.path.join(SHARED_MEMORY_DIR, file_name)
+        try:
+            pid = int(file_name.split("-")[0])
+            if os.stat(file_path).st_uid != os.getuid():
+                continue
+        except (ValueError, FileNotFoundError):
+            continue
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+        except PermissionError:
+            pass
+
+
+def get_shared_memory_size(nbytes):
+    """Round nbytes up to SHARED_MEMORY_ALIGNMENT.
+    """
+    return -(-nbytes // SHARED_MEMORY_ALIGNMENT) * SHARED_MEMORY_ALIGNMENT
+
+
+def resolve_shared_memory_obs(obs, shared_memories):
+    """Resolve SharedMemoryObs in obs (possibly nested in dicts) into read-only views of the shared memory.
+
+    Arguments:
+        obs: obs possibly holding SharedMemoryObs
+        shared_memories: dict of the mapped shared memory of each path, updated when a new path is met
+    """
+    if isinstance(obs, dict):
+        return {
+            key: resolve_shared_memory_obs(value, shared_memories) for key, value in obs.items()
+        }
+    if isinstance(obs, SharedMemoryObs):
+        if obs.hostname != SHARED_MEMORY_HOSTNAME:
+            error = "Shared memory obs from host {} cannot be read on host {}, disable is_shared_memory_obs".format(
+                obs.hostname,
+                SHARED_MEMORY_HOSTNAME,
+            )
+            logger.error(error)
+            raise Exception(error)
+        if obs.path not in shared_memories.keys():
+            shared_memories[obs.path] = np.memmap(
+                obs.path, dtype=np.uint8, mode="r"
+            )
+        return np.ndarray(
+            obs.shape,
+            dtype=np.dtype(obs.dtype),
+            buffer=shared_memories[obs.path],
+            offset=obs.offset,
+        )
+    return obs
+
+
+def gather_multi_agent_obs(obs, gather_index, dimension_to_cat):
+    """Gather and concatenate observations of selected agents for all agents at once.
+
+    Arguments:
+        obs: observations of all agents, of shape (number_agents, ...)
+        gather_index: of shape (number_agents, number_selected_agents),
+            gather_index[i] are the agents selected for agent i
+        dimension_to_cat: the dimension (of a single observation) at which the
+            observations of selected agents are concatenated
+    Returns:
+        of shape (number_agents, ...), where the dimension_to_cat of a single
+        observation is number_selected_agents times larger
+    """
+    # (number_agents, number_selected_agents, ...)
+    obs = obs[gather_index]
+    # (number_agents, ..., number_selected_agents, dimension_to_cat, ...)
+    obs = np.moveaxis(obs, 1, dimension_to_cat + 1)
+    return obs.reshape(
+        obs.shape[:dimension_to_cat + 1] + (-1,) +
+        obs.shape[dimension_to_cat + 3:]
+    )
+
+
+class UnityEnvCrash(Exception):
+    """Raised by ArenaUnityEnv when the game has exited or has been unresponsive for too long.
+    """
+    pass
+
+
+def close_unity_env(unity_env, rank):
+    """Close unity_env and release its rank.
+    """
+    try:
+        unity_env.close()
+    finally:
+        release_unity_rank(rank)
+
+
+class StandbyPool(object):
+    """The hot spare of the ArenaRllibEnv of a rollout worker, see ArenaRllibEnv.recycle.
+    Keeps at most one standby game, booted in the background and taken by whichever env is due for recycling,
+    which then boots the next one. Games taken out of service are also closed in the background.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # future of (ArenaUnityEnv, rank, startup_time) of the standby game
+        self.standby = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def boot(self, create_unity_env):
+        """Boot a standby game with create_unity_env in the background, if there is no standby game.
+        """
+        with self.lock:
+            if self.standby is None:
+                self.standby = self.executor.submit(create_unity_env)
+
+    def take(self):
+        """Take the standby game if it has booted.
+
+        Returns:
+            (ArenaUnityEnv, rank, startup_time) of the standby game, None if there is no booted one
+        """
+
+        with self.lock:
+            if (self.standby is None) or (not self.standby.done()):
+                return None
+            standby, self.standby = self.standby, None
+
+        try:
+            return standby.result()
+        except Exception as e:
+            logger.warning("Boot standby ArenaUnityEnv failed {}".format(e))
+            return None
+
+    def close_in_background(self, unity_env, rank):
+        """Close unity_env and release its rank in the background.
+        """
+        self.executor.submit(close_unity_env, unity_env, rank)
+
+    def close(self):
+        """Close the standby game (waiting for it if it is booting) and the games being closed in the background.
+        """
+
+        with self.lock:
+            standby, self.standby = self.standby, None
+
+        if standby is not None:
+            try:
+                close_unity_env(*standby.result()[:2])
+            except Exception as e:
+                logger.warning("Close standby ArenaUnityEnv failed {}".format(e))
+        self.executor.shutdown()
+
+
+class EncodedVisualObservation(object):
+    """A compressed frame of a camera of an agent, as received from the communicator.
+    """
+
+    __slots__ = ["image_bytes", "gray_scale"]
+
+    def __init__(self, image_bytes, gray_scale):
+        self.image_bytes = image_bytes
+        self.gray_scale = gray_scale
+
+
+def defer_visual_observation_decoding():
+    """Make BrainInfo keep the visual observations as EncodedVisualObservation,
+    instead of decoding them one after another when receiving them from the communicator,
+    so that ArenaUnityEnv can decode them concurrently, and only for the cameras it uses.
+    This affects all BrainInfo in the process, it is called once when this module is imported.
+    """
+    BrainInfo.process_pixels = staticmethod(EncodedVisualObservation)
+
+
+# arena-spec: decode visual observations in ArenaUnityEnv._preprocess_multi, instead of in the communicator
+defer_visual_observation_decoding()
+
+
+def decode_visual_observation(encoded, out):
+    """Decode an EncodedVisualObservation into out of shape (height, width, depth),
+    in [0, 255] if out is uint8, or in [0, 1] otherwise.
+    cv2 releases the GIL when decoding, so frames can be decoded by multiple threads.
+    """
+    image = cv2.imdecode(
+        np.frombuffer(encoded.image_bytes, dtype=np.uint8),
+        cv2.IMREAD_COLOR,
+    )
+    if image is None:
+        error = "Cannot decode a visual observation of {} bytes".format(
+            len(encoded.image_bytes)
+        )
+        logger.error(error)
+        raise Exception(error)
+    if encoded.gray_scale:
+        # same as ml-agents, gray scale is the mean of the channels
+        image = image.mean(axis=2, keepdims=True)
+    else:
+        # cv2 decodes into BGR
+        image = image[..., ::-1]
+    if out.dtype == np.uint8:
+        np.copyto(out, image, casting="unsafe")
+    else:
+        np.multiply(image, 1.0 / 255.0, out=out, casting="unsafe")
+
+
 class ArenaRllibEnv(MultiAgentEnv):
     """Convert ArenaUnityEnv(gym_unity) to MultiAgentEnv (rllib)
 
@@ -57,61 +454,157 @@ class ArenaRllibEnv(MultiAgentEnv):
             "multi_agent_obs", ["own"]
         )
 
+        # keep visual obs as uint8 all the way into the sample batch,
+        # they are normalized to float inside the model (see ArenaVisionNetwork)
+        self.is_uint8_visual = env_config.get("is_uint8_visual", False)
+
+        # only receive visual observations from the cameras needed by the sensors
+        self.cameras = sorted(set(
+            [SENSOR2CAMERA[sensor] for sensor in self.sensors if sensor in SENSOR2CAMERA.keys()]
+        ))
+
         self.dimension_to_cat_multi_agent_obs_for_sensor = {
             "visual_FP": 2,
             "visual_TP": 2,
             "vector": 0,
         }
 
-        game_file_path, extension_name = get_env_directory(self.env_id)
-
-        # check of we can use a server build
-        if is_list_match(self.sensors, "vector"):
-            if os.path.exists(game_file_path + '-Server'):
-                game_file_path = game_file_path + '-Server'
+        # unity: launch the game build;
+        # simulated: drive SimulatedUnityEnvironment (simulated.py) instead, to profile the wrappers without a game
+        self.backend = env_config.get("backend", "unity")
+        _validate_backend(self.backend)
+
+        self.no_graphics = False
+        if self.backend in ["simulated"]:
+            self.simulated_config = {
+                "number_agents": len(flatten_list(self.social_config)),
+                "action_space_type": self.env_id.split("-")[-1].lower(),
+            }
+            self.simulated_config.update(
+                env_config.get("simulated_config", {})
+            )
+            game_file_path = self.env_id
+        else:
+            self.simulated_config = None
+            game_file_path, extension_name = get_env_directory(self.env_id)
+
+            # check of we can use a server build,
+            # or launch the full build without graphics, so that no X server is needed
+            if not self.is_any_visual_sensor():
+                if os.path.exists(game_file_path + '-Server' + extension_name):
+                    game_file_path = game_file_path + '-Server'
+                    logger.info(
+                        "Using server build."
+                    )
+                else:
+                    self.no_graphics = True
+                    logger.info(
+                        "Using full build without graphics, since no visual observation is used. " +
+                        "You can have a server build which runs faster."
+                    )
+            else:
                 logger.info(
-                    "Using server build."
+                    "Using full build."
                 )
-            else:
-                logger.warning(
-                    "Only vector observation is used, you can have a server build which runs faster."
+
+            if not os.path.exists(game_file_path + extension_name):
+                error = "Game build {} does not exist".format(
+                    game_file_path + extension_name
                 )
-        else:
-            logger.info(
-                "Using full build."
+                logger.error(error)
+                raise Exception(error)
+
+        self.game_file_path = game_file_path
+
+        self.train_mode = env_config.get("train_mode", True)
+
+        self.preferred_rank = get_preferred_unity_rank(env_config)
+        self.max_launch_retries = env_config.get(
+            "max_launch_retries", MAX_LAUNCH_RETRIES
+        )
+        self.decode_threads = env_config.get(
+            "decode_threads", DECODE_THREADS
+        )
+
+        # supervision of the game, a crashed or hung game is relaunched, see relaunch
+        self.step_timeout = env_config.get("step_timeout", STEP_TIMEOUT)
+        self.max_relaunches = env_config.get("max_relaunches", MAX_RELAUNCHES)
+        self.max_relaunch_backoff = env_config.get(
+            "max_relaunch_backoff", MAX_RELAUNCH_BACKOFF
+        )
+        self.consecutive_relaunches = 0
+
+        # recycling of the game with a hot spare, a standby game is booted in the background at the first reset,
+        # and swapped in at a reset once the game passes recycle_episodes or recycle_rss_mb, see recycle
+        self.recycle_episodes = env_config.get(
+            "recycle_episodes", RECYCLE_EPISODES
+        )
+        self.recycle_rss_mb = env_config.get("recycle_rss_mb", RECYCLE_RSS_MB)
+        self.is_hot_spare = (self.recycle_episodes > 0) or (
+            self.recycle_rss_mb > 0
+        )
+        # the StandbyPool shared by the envs of a rollout worker (see ArenaVectorEnv),
+        # or one owned by this env if it is not set by set_standby_pool before the first reset
+        self.standby_pool = None
+        self.is_own_standby_pool = False
+        self.episodes_since_launch = 0
+
+        # latencies of the stages of reset and step, see drain_latency_histograms
+        self.latency_timers = LatencyTimers()
+
+        # launch the game at the first reset, if number_agents and spaces of the game are in the metadata cache,
+        # so that envs that are never stepped (e.g., for checking spaces) do not hold a game
+        self.is_lazy_launch = env_config.get("is_lazy_launch", True)
+        self.env, self.rank, self.startup_time = None, None, None
+        unity_env_infos = None
+        if self.is_lazy_launch:
+            unity_env_infos = load_metadata_cache(
+                "unity_env_infos", self.get_unity_env_infos_cache_key()
+            )
+        if unity_env_infos is None:
+            self.launch()
+            unity_env_infos = {
+                "number_agents": self.env.number_agents,
+                "action_space": self.env.action_space,
+                "observation_space": self.env.observation_space,
+            }
+            save_metadata_cache(
+                "unity_env_infos", self.get_unity_env_infos_cache_key(), unity_env_infos
             )
 
-        if not os.path.exists(game_file_path + extension_name):
-            error = "Game build {} does not exist".format(
-                game_file_path + extension_name
+        self.number_agents = dcopy(unity_env_infos["number_agents"])
+        self.agent_ids_rllib = tuple(
+            agent_i2id(agent_i_rllib) for agent_i_rllib in range(self.number_agents)
+        )
+
+        # full: infos of each agent is the infos of gym_unity, including the BrainInfo of all agents,
+        #   whose visual_observations are EncodedVisualObservation (see defer_visual_observation_decoding),
+        #   which can be decoded with decode_visual_observation;
+        # slim: infos of each agent only has the scalar fields of the agent;
+        # none: infos of each agent is empty.
+        self.infos_mode = env_config.get(
+            "infos_mode", "slim" if self.train_mode else "full"
+        )
+        _validate_infos_mode(self.infos_mode)
+
+        # repeat each action for action_repeat steps of the game, summing the rewards
+        self.action_repeat = env_config.get("action_repeat", 1)
+        if (not isinstance(self.action_repeat, int)) or (self.action_repeat < 1):
+            error = "action_repeat should be a positive int, got {}".format(
+                self.action_repeat,
             )
             logger.error(error)
             raise Exception(error)
-        while True:
-            try:
-                # TODO: Individual game instance cannot get rank from rllib, so just try ranks
-                rank = random.randint(10000, 60000)
-                self.env = ArenaUnityEnv(
-                    game_file_path,
-                    rank,
-                    use_visual=False,
-                    uint8_visual=False,
-                    multiagent=True,
-                    allow_multiple_visual_obs=True,
-                )
-                break
-            except Exception as e:
-                logger.warning("Start ArenaUnityEnv failed {}, retrying...".format(
-                    e
-                ))
-
-        self.number_agents = dcopy(self.env.number_agents)
-
-        self.train_mode = env_config.get("train_mode", True)
-        self.env.set_train_mode(self.train_mode)
 
         self.is_shuffle_agents = env_config.get("is_shuffle_agents", False)
 
+        # reset at the step the episode is done, the obs of this reset is returned by the following reset,
+        # so that the reset called by rllib at the start of the next episode does not reset the game again
+        self.is_auto_reset = env_config.get("is_auto_reset", IS_AUTO_RESET)
+        self.pending_reset_obs = None
+        # obs_rllib of the last reset or step, returned by truncate_episode without the auto reset
+        self.last_obs_rllib = None
+
         self.agent_i_rllib2gymunity = np.arange(self.number_agents)
         self.agent_i_gymunity2rllib = np.arange(self.number_agents)
         self.sync_agent_i_gymunity2rllib()
@@ -155,16 +648,67 @@ class ArenaRllibEnv(MultiAgentEnv):
             )
             self.agent_i_gymunity_mapping["all_relative"][agent_i] += self.agent_i_gymunity_mapping["team_relative"][agent_i]
 
-        self.action_space = dcopy(self.env.action_space)
+        self.action_space = dcopy(unity_env_infos["action_space"])
+
+        # emit the observations of all agents stacked once per step and shared by all agents,
+        # with a per-agent gather_index, instead of a concatenation for each agent,
+        # for the multi_agent_obs selecting all agents (all_*).
+        # The concatenation can be reconstructed in a model with gather_compact_multi_agent_obs (models.py).
+        # This saves the gathering and copying in the env only: rllib's Dict preprocessor still flattens
+        # the stack into a float32 copy for each agent, so sample batches are not smaller.
+        self.is_compact_multi_agent_obs = env_config.get(
+            "is_compact_multi_agent_obs", False
+        )
+        if self.is_compact_multi_agent_obs and self.is_uint8_visual:
+            error = "is_compact_multi_agent_obs does not support is_uint8_visual, since rllib flattens the Dict of the compact form into floats"
+            logger.error(error)
+            raise Exception(error)
+        if self.is_compact_multi_agent_obs:
+            team_multi_agent_obs = [
+                multi_agent_ob for multi_agent_ob in self.multi_agent_obs if multi_agent_ob.split("_")[0] == "team"
+            ]
+            if len(team_multi_agent_obs) > 0:
+                # rllib copies the obs of each agent into the sample batch,
+                # the stack of all agents would be larger than the concatenation of a team
+                logger.warning(
+                    "is_compact_multi_agent_obs only applies to all_*, {} are emitted as concatenations".format(
+                        team_multi_agent_obs,
+                    )
+                )
 
         self.observation_spaces = {}
         agent_i_gymunity = 0
         for multi_agent_ob in self.multi_agent_obs:
             for sensor in self.sensors:
                 observation_space = dcopy(
-                    self.env.observation_space[sensor]
+                    unity_env_infos["observation_space"][sensor]
                 )
 
+                if self.is_multi_agent_ob_compact(multi_agent_ob):
+                    self.observation_spaces["{}-{}".format(
+                        multi_agent_ob,
+                        sensor,
+                    )] = gym.spaces.Dict({
+                        "stacked": gym.spaces.Box(
+                            low=observation_space.low.min(),
+                            high=observation_space.high.max(),
+                            shape=(self.number_agents,) +
+                            observation_space.shape,
+                            dtype=observation_space.dtype,
+                        ),
+                        "gather_index": gym.spaces.Box(
+                            low=0,
+                            high=self.number_agents - 1,
+                            shape=(
+                                len(
+                                    self.agent_i_gymunity_mapping[multi_agent_ob][agent_i_gymunity]
+                                ),
+                            ),
+                            dtype=np.int64,
+                        ),
+                    })
+                    continue
+
                 observation_space.shape = replace_in_tuple(
                     tup=observation_space.shape,
                     index=self.dimension_to_cat_multi_agent_obs_for_sensor[
@@ -182,22 +726,545 @@ class ArenaRllibEnv(MultiAgentEnv):
                     sensor,
                 )] = observation_space
 
-        self.observation_space = try_reduce_dict(self.observation_spaces)
-        if isinstance(self.observation_space, dict):
-            self.observation_space = gym.spaces.Dict(self.observation_space)
+        # emit the obs of each agent as one flat float32 array, instead of a dict of multi_agent_ob-sensor,
+        # which rllib would flatten at every step.
+        # flat_obs_offsets[obs_key] is (start, end, shape) of each multi_agent_ob-sensor in the flat array,
+        # it can be split in a model with split_flat_obs (models.py).
+        self.is_flatten_obs = env_config.get(
+            "is_flatten_obs", False
+        ) and (len(self.observation_spaces) > 1)
+        if self.is_flatten_obs:
+            if self.is_compact_multi_agent_obs or self.is_uint8_visual:
+                error = "is_flatten_obs does not support is_compact_multi_agent_obs or is_uint8_visual"
+                logger.error(error)
+                raise Exception(error)
+            self.flat_obs_offsets = {}
+            self.flat_obs_size = 0
+            lows = []
+            highs = []
+            for multi_agent_ob in self.multi_agent_obs:
+                for sensor in self.sensors:
+                    obs_key = "{}-{}".format(
+                        multi_agent_ob,
+                        sensor,
+                    )
+                    observation_space = self.observation_spaces[obs_key]
+                    self.flat_obs_offsets[obs_key] = (
+                        self.flat_obs_size,
+                        self.flat_obs_size + int(np.prod(observation_space.shape)),
+                        tuple(observation_space.shape),
+                    )
+                    self.flat_obs_size = self.flat_obs_offsets[obs_key][1]
+                    # low and high of team_* and all_* keep the shape of a single agent,
+                    # so they are filled to the size of the multi_agent_ob-sensor
+                    lows += [np.full(
+                        self.flat_obs_offsets[obs_key][1] - self.flat_obs_offsets[obs_key][0],
+                        observation_space.low.min(),
+                        dtype=np.float32,
+                    )]
+                    highs += [np.full(
+                        self.flat_obs_offsets[obs_key][1] - self.flat_obs_offsets[obs_key][0],
+                        observation_space.high.max(),
+                        dtype=np.float32,
+                    )]
+            self.observation_space = gym.spaces.Box(
+                low=np.concatenate(lows),
+                high=np.concatenate(highs),
+                dtype=np.float32,
+            )
+        else:
+            self.observation_space = try_reduce_dict(self.observation_spaces)
+            if isinstance(self.observation_space, dict):
+                self.observation_space = gym.spaces.Dict(
+                    self.observation_space
+                )
+
+        self.compile_agent_mapping()
+
+        # reuse preallocated obs buffers, see allocate_obs_buffers
+        self.is_reuse_obs_buffers = env_config.get(
+            "is_reuse_obs_buffers", False
+        )
+
+        # place the ring of obs buffers in shared memory, and return handles (SharedMemoryObs) instead of obs,
+        # if this is a remote env (remote_worker_envs), so that the obs are not pickled through ray.
+        # The rollout worker resolves the handles into views of the shared memory, see SharedMemoryObsEnv.
+        self.is_shared_memory_obs = env_config.get(
+            "is_shared_memory_obs", False
+        ) and getattr(env_config, "remote", False)
+        self.shared_memory = None
+        if self.is_shared_memory_obs and (not self.is_reuse_obs_buffers):
+            error = "is_shared_memory_obs requires is_reuse_obs_buffers"
+            logger.error(error)
+            raise Exception(error)
+
+        if self.is_reuse_obs_buffers:
+            self.allocate_obs_buffers(
+                env_config.get("obs_buffers_depth", None)
+            )
+
+    def is_multi_agent_ob_compact(self, multi_agent_ob):
+        """Check if multi_agent_ob is emitted in the compact form, see is_compact_multi_agent_obs.
+        """
+        return self.is_compact_multi_agent_obs and (multi_agent_ob.split("_")[0] == "all") and (
+            len(self.agent_i_gymunity_mapping[multi_agent_ob][0]) > 1
+        )
+
+    def get_unity_env_infos_cache_key(self):
+        """Get the key identifying number_agents and spaces of the game in the metadata cache.
+        """
+        return {
+            "version": SPACES_CACHE_VERSION,
+            "env_id": self.env_id,
+            "binary": get_env_binary_signature(self.env_id),
+            "cameras": self.cameras,
+            "is_uint8_visual": self.is_uint8_visual,
+            "backend": self.backend,
+            "simulated_config": self.simulated_config,
+        }
+
+    def launch(self):
+        """Launch the game, if it has not been launched.
+        """
+        if self.env is None:
+            if not self.swap_in_standby():
+                self.env, self.rank, self.startup_time = self.create_unity_env()
+                self.episodes_since_launch = 0
+
+    def set_standby_pool(self, standby_pool):
+        """Share standby_pool with the other envs of the rollout worker, instead of owning one,
+        so that the worker keeps one standby game instead of one per env.
+        """
+        self.standby_pool = standby_pool
+        self.is_own_standby_pool = False
+
+    def boot_standby(self):
+        """Boot a standby game in the background, if a hot spare is kept and there is no standby game.
+        """
+        if self.is_hot_spare:
+            if self.standby_pool is None:
+                self.standby_pool = StandbyPool()
+                self.is_own_standby_pool = True
+            self.standby_pool.boot(self.create_unity_env)
+
+    def swap_in_standby(self):
+        """Swap in the standby game if it has booted, closing the current game (if any) in the background,
+        and boot the next standby game after that.
+
+        Returns:
+            if the standby game is swapped in
+        """
+
+        if self.standby_pool is None:
+            return False
+
+        standby = self.standby_pool.take()
+        if standby is None:
+            self.boot_standby()
+            return False
+
+        if self.env is not None:
+            self.standby_pool.close_in_background(self.env, self.rank)
+        self.env, self.rank, self.startup_time = standby
+        self.episodes_since_launch = 0
+        logger.info("Swapped in standby ArenaUnityEnv at rank {}".format(
+            self.rank,
+        ))
+
+        self.boot_standby()
+        return True
+
+    def is_recycle_due(self):
+        """Check if the game has passed recycle_episodes or recycle_rss_mb.
+        """
+
+        if (self.recycle_episodes > 0) and (self.episodes_since_launch >= self.recycle_episodes):
+            return True
+
+        if self.recycle_rss_mb > 0:
+            # no process for the simulated backend
+            proc = getattr(self.env._env, "proc1", None)
+            if proc is not None:
+                try:
+                    rss = psutil.Process(proc.pid).memory_info().rss
+                except psutil.Error:
+                    # a dead game is relaunched by the supervision
+                    return False
+                if rss > self.recycle_rss_mb * 1024 * 1024:
+                    return True
+
+        return False
+
+    def recycle(self):
+        """Swap in the standby game if the game is due for recycling.
+        If the standby game has not booted yet, the current game is kept until a later reset,
+        so that recycling never waits for a boot.
+        The first standby game is booted here, so that envs that are never reset do not boot one.
+        """
+        if self.is_hot_spare:
+            if self.is_recycle_due():
+                self.swap_in_standby()
+            else:
+                self.boot_standby()
+
+    def get_game_timeout(self):
+        """Get the timeout of a step or a reset of the game, None if the game is not supervised.
+        """
+        if self.step_timeout > 0:
+            return self.step_timeout
+        return None
+
+    def relaunch(self, e):
+        """Close the game that crashed or hung (with UnityEnvCrash e), and launch a new one after backing off.
+        Raise if the game has been relaunched max_relaunches times without a successful step in between.
+        """
+
+        self.consecutive_relaunches += 1
+        if self.consecutive_relaunches > self.max_relaunches:
+            error = "ArenaUnityEnv at rank {} crashed {} times in a row, the last time: {}".format(
+                self.rank,
+                self.consecutive_relaunches,
+                e,
+            )
+            logger.error(error)
+            raise Exception(error)
+
+        backoff = min(
+            RELAUNCH_BACKOFF_MIN * 2 ** (self.consecutive_relaunches - 1),
+            self.max_relaunch_backoff,
+        )
+        logger.warning("ArenaUnityEnv at rank {} crashed: {}, relaunching in {:.1f} seconds ({}/{})...".format(
+            self.rank,
+            e,
+            backoff,
+            self.consecutive_relaunches,
+            self.max_relaunches,
+        ))
+
+        try:
+            self.env.close(is_crashed=True)
+        except Exception as close_e:
+            logger.warning("Close crashed ArenaUnityEnv at rank {} failed {}".format(
+                self.rank,
+                close_e,
+            ))
+        release_unity_rank(self.rank)
+        self.env = None
+
+        time.sleep(backoff)
+        # the standby game is swapped in if it has booted, see launch
+        self.launch()
+
+    def truncate_episode(self):
+        """Get returns_rllib ending the episode, which is truncated since the game crashed and has been relaunched.
+        With the auto reset, the obs are those of the reset of the relaunched game,
+        otherwise they are the obs of the last step, and the relaunched game is reset by the reset of rllib.
+        Infos of all agents are {"is_truncated": True}.
+        """
+
+        if self.is_auto_reset:
+            # the relaunched game is reset here, as for the auto reset
+            obs_rllib = self.reset()
+            self.pending_reset_obs = obs_rllib
+        else:
+            obs_rllib = self.last_obs_rllib
+
+        rewards_rllib = dict.fromkeys(self.agent_ids_gymunity, 0.0)
+        dones_rllib = dict.fromkeys(self.agent_ids_gymunity, True)
+        dones_rllib["__all__"] = True
+        infos_rllib = {
+            agent_id_rllib: {"is_truncated": True} for agent_id_rllib in self.agent_ids_gymunity
+        }
+
+        return obs_rllib, rewards_rllib, dones_rllib, infos_rllib
+
+    def is_any_visual_sensor(self):
+        """Check if any of the sensors is a visual sensor.
+        """
+        for sensor in self.sensors:
+            if sensor.split("_")[0] == "visual":
+                return True
+        return False
+
+    def create_unity_env(self):
+        """Launch a game instance at a free rank, retrying at most max_launch_retries times.
+
+        Returns:
+            (ArenaUnityEnv, rank, startup_time)
+        """
+
+        launch_start = time.time()
+        preferred_rank = self.preferred_rank
+
+        for launch_i in range(self.max_launch_retries + 1):
+            rank = acquire_unity_rank(preferred_rank)
+            try:
+                unity_env = ArenaUnityEnv(
+                    self.game_file_path,
+                    rank,
+                    use_visual=False,
+                    uint8_visual=self.is_uint8_visual,
+                    multiagent=True,
+                    allow_multiple_visual_obs=True,
+                    no_graphics=self.no_graphics,
+                    cameras=self.cameras,
+                    decode_threads=self.decode_threads,
+                    simulated_config=self.simulated_config,
+                )
+                break
+            except Exception as e:
+                release_unity_rank(rank)
+                # the port of this rank might be taken by other programs
+                preferred_rank = rank + UNITY_RANK_PROBE_STRIDE
+                logger.warning("Start ArenaUnityEnv at rank {} failed {}, retrying ({}/{})...".format(
+                    rank,
+                    e,
+                    launch_i + 1,
+                    self.max_launch_retries,
+                ))
+        else:
+            error = "Start ArenaUnityEnv failed after {} retries".format(
+                self.max_launch_retries,
+            )
+            logger.error(error)
+            raise Exception(error)
+
+        unity_env.set_train_mode(self.train_mode)
+
+        startup_time = time.time() - launch_start
+        logger.info("Started ArenaUnityEnv at rank {} in {:.2f} seconds".format(
+            rank,
+            startup_time,
+        ))
+
+        return unity_env, rank, startup_time
+
+    def compile_agent_mapping(self):
+        """Compile agent_i_gymunity_mapping into gather tables,
+        so that obs_gymunity2rllib converts each multi_agent_ob-sensor for all agents with one gather.
+
+        Each item in obs_gather_specs is (obs_key, sensor_type, camera_i, gather_index, dimension_to_cat, is_compact),
+        where camera_i indexes the cameras received from the game (self.cameras),
+        gather_index is of shape (number_agents, number_selected_agents),
+        and is_compact is if obs_key is emitted in the compact form (see is_compact_multi_agent_obs).
+        """
+        self.obs_gather_specs = []
+        for multi_agent_ob in self.multi_agent_obs:
+            gather_index = np.asarray(
+                [
+                    self.agent_i_gymunity_mapping[multi_agent_ob][agent_i_gymunity]
+                    for agent_i_gymunity in range(self.number_agents)
+                ],
+                dtype=np.int64,
+            )
+            for sensor in self.sensors:
+                self.obs_gather_specs += [(
+                    "{}-{}".format(
+                        multi_agent_ob,
+                        sensor,
+                    ),
+                    sensor.split("_")[0],
+                    # index of the camera in the received visual observations
+                    self.cameras.index(
+                        SENSOR2CAMERA[sensor]
+                    ) if sensor in SENSOR2CAMERA.keys() else None,
+                    gather_index,
+                    self.dimension_to_cat_multi_agent_obs_for_sensor[sensor],
+                    self.is_multi_agent_ob_compact(multi_agent_ob),
+                )]
+        self.obs_gather_specs = tuple(self.obs_gather_specs)
+
+    def allocate_obs_buffers(self, obs_buffers_depth):
+        """Allocate a ring of obs_buffers_depth preallocated obs buffers, obs_gymunity2rllib writes
+        obs of each step into the next buffer in the ring, instead of allocating new arrays.
+
+        The obs returned at a step are overwritten obs_buffers_depth steps later,
+        so obs_buffers_depth has to be larger than the number of steps rllib holds an obs
+        before copying it into a sample batch (see expand_exp in arena.py).
+
+        obs_buffers[buffer_i], obs_buffers_views[buffer_i] and flat_obs_buffers[buffer_i]
+        are allocated by allocate_obs_buffer.
+        """
+
+        if (obs_buffers_depth is None) or (obs_buffers_depth < MIN_OBS_BUFFERS_DEPTH):
+            error = "is_reuse_obs_buffers requires obs_buffers_depth >= {}, got {}".format(
+                MIN_OBS_BUFFERS_DEPTH,
+                obs_buffers_depth,
+            )
+            logger.error(error)
+            raise Exception(error)
+
+        self.obs_buffers_depth = obs_buffers_depth
+        self.obs_buffers_i = 0
+
+        if self.is_shared_memory_obs:
+            # size the shared memory with an obs buffer allocated in process memory
+            flat_obs, obs_buffers, _ = self.allocate_obs_buffer()
+            self.create_shared_memory(
+                self.obs_buffers_depth * sum([
+                    get_shared_memory_size(obs_buffer.nbytes) for obs_buffer in (
+                        [flat_obs] if flat_obs is not None else obs_buffers
+                    )
+                ])
+            )
+
+        self.obs_buffers = []
+        self.obs_buffers_views = []
+        self.flat_obs_buffers = []
+        for buffer_i in range(self.obs_buffers_depth):
+            flat_obs, obs_buffers, obs_buffers_views = self.allocate_obs_buffer()
+            self.obs_buffers += [obs_buffers]
+            self.obs_buffers_views += [obs_buffers_views]
+            self.flat_obs_buffers += [flat_obs]
+
+    def allocate_obs_buffer(self):
+        """Allocate a buffer for the obs of all agents at a step.
+
+        obs_buffers[spec_i] is of shape (number_agents,) + observation_spaces[obs_key].shape,
+        obs_buffers_views[spec_i] is a view of it in the layout of gathered obs,
+        i.e., (number_agents, number_selected_agents, ...).
+        For obs_key in the compact form, both are the stacked obs of all agents.
+        If is_flatten_obs, flat_obs is of shape (number_agents, flat_obs_size),
+        and obs_buffers are views of the segments of it, otherwise flat_obs is None.
+
+        Returns:
+            (flat_obs, obs_buffers, obs_buffers_views)
+        """
+
+        if self.is_flatten_obs:
+            flat_obs = self.allocate_obs_array(
+                (self.number_agents, self.flat_obs_size),
+                dtype=np.float32,
+            )
+        else:
+            flat_obs = None
+
+        obs_buffers = []
+        obs_buffers_views = []
+        for obs_key, _, _, gather_index, dimension_to_cat, is_compact in self.obs_gather_specs:
+            if is_compact:
+                observation_space = self.observation_spaces[obs_key].spaces["stacked"]
+                obs_buffer = self.allocate_obs_array(
+                    observation_space.shape,
+                    dtype=observation_space.dtype,
+                )
+                obs_buffers += [obs_buffer]
+                obs_buffers_views += [obs_buffer]
+                continue
+            observation_space = self.observation_spaces[obs_key]
+            if self.is_flatten_obs:
+                start, end, _ = self.flat_obs_offsets[obs_key]
+                # splitting the last dimension, so this is a view of flat_obs
+                obs_buffer = flat_obs[:, start:end].reshape(
+                    (self.number_agents,) + observation_space.shape
+                )
+            else:
+                obs_buffer = self.allocate_obs_array(
+                    (self.number_agents,) + observation_space.shape,
+                    dtype=observation_space.dtype,
+                )
+            # split dimension_to_cat into (number_selected_agents, dimension_to_cat)
+            obs_buffer_view = obs_buffer.reshape(
+                obs_buffer.shape[:dimension_to_cat + 1] +
+                (np.shape(gather_index)[1], -1) +
+                obs_buffer.shape[dimension_to_cat + 2:]
+            )
+            obs_buffer_view = np.moveaxis(
+                obs_buffer_view, dimension_to_cat + 1, 1
+            )
+            obs_buffers += [obs_buffer]
+            obs_buffers_views += [obs_buffer_view]
+
+        return flat_obs, tuple(obs_buffers), tuple(obs_buffers_views)
+
+    def allocate_obs_array(self, shape, dtype):
+        """Allocate an array of zeros for obs buffers, in the shared memory if it is created.
+        """
+        if self.shared_memory is None:
+            return np.zeros(shape, dtype=dtype)
+        array = np.ndarray(
+            shape,
+            dtype=dtype,
+            buffer=self.shared_memory,
+            offset=self.shared_memory_used,
+        )
+        self.shared_memory_used += get_shared_memory_size(array.nbytes)
+        return array
+
+    def create_shared_memory(self, size):
+        """Create the shared memory of size bytes, from which allocate_obs_array allocates.
+        """
+        # private to this user, the rollout worker reading it runs as the same user
+        os.makedirs(SHARED_MEMORY_DIR, mode=0o700, exist_ok=True)
+        _reclaim_stale_shared_memory()
+        self.shared_memory_path = os.path.join(
+            SHARED_MEMORY_DIR,
+            "{}-{}.obs".format(os.getpid(), id(self)),
+        )
+        self.shared_memory = np.memmap(
+            self.shared_memory_path,
+            dtype=np.uint8,
+            mode="w+",
+            shape=(max(size, 1),),
+        )
+        self.shared_memory_used = 0
+        self.shared_memory_address = self.shared_memory.__array_interface__[
+            "data"
+        ][0]
+        logger.info("Created shared memory {} of {} bytes for obs".format(
+            self.shared_memory_path,
+            size,
+        ))
+
+    def to_shared_memory_obs(self, obs):
+        """Replace the arrays in obs (possibly nested in dicts) that are in the shared memory
+        with SharedMemoryObs handles to them.
+        """
+        if isinstance(obs, dict):
+            return {
+                key: self.to_shared_memory_obs(value) for key, value in obs.items()
+            }
+        if isinstance(obs, np.ndarray) and obs.flags.c_contiguous:
+            offset = obs.__array_interface__["data"][0] - \
+                self.shared_memory_address
+            if (offset >= 0) and (offset + obs.nbytes <= self.shared_memory.nbytes):
+                return SharedMemoryObs(
+                    hostname=SHARED_MEMORY_HOSTNAME,
+                    path=self.shared_memory_path,
+                    offset=offset,
+                    shape=obs.shape,
+                    dtype=obs.dtype.str,
+                )
+        return obs
 
     def sync_agent_i_gymunity2rllib(self):
-        """sync agent_i_gymunity2rllib with agent_i_rllib2gymunity
+        """sync agent_i_gymunity2rllib and agent_ids_gymunity with agent_i_rllib2gymunity
 
         """
-        for agent_i_gymunity in range(self.number_agents):
-            self.agent_i_gymunity2rllib[agent_i_gymunity] = np.where(
-                self.agent_i_rllib2gymunity == agent_i_gymunity
-            )[0][0]
+        self.agent_i_gymunity2rllib[self.agent_i_rllib2gymunity] = np.arange(
+            self.number_agents
+        )
+        # agent_ids_gymunity[agent_i_gymunity] is the agent_id_rllib of agent_i_gymunity
+        self.agent_ids_gymunity = tuple(
+            self.agent_ids_rllib[agent_i_rllib] for agent_i_rllib in self.agent_i_gymunity2rllib
+        )
 
     def shuffle_agent_mapping(self):
+        shuffle_start = time.perf_counter()
         np.random.shuffle(self.agent_i_rllib2gymunity)
         self.sync_agent_i_gymunity2rllib()
+        self.latency_timers.add(
+            "shuffle_agent_mapping", time.perf_counter() - shuffle_start
+        )
+
+    def drain_latency_histograms(self):
+        """Return LatencyHistogram of each stage of reset and step since the last drain,
+        including those of the game (ArenaUnityEnv).
+        """
+        histograms_to_merge = [self.latency_timers.drain()]
+        if self.env is not None:
+            histograms_to_merge += [self.env.latency_timers.drain()]
+        return merge_latency_histograms(histograms_to_merge)
 
     def run_an_episode(self, actions=None):
         """Run an episode with actions at each step.
@@ -219,33 +1286,110 @@ class ArenaRllibEnv(MultiAgentEnv):
 
     def reset(self):
 
+        # the game has been reset at the step the last episode is done
+        if self.pending_reset_obs is not None:
+            obs_rllib = self.pending_reset_obs
+            self.pending_reset_obs = None
+            return obs_rllib
+
+        reset_start = time.perf_counter()
+
+        self.launch()
+        self.recycle()
+        self.episodes_since_launch += 1
+
         if self.is_shuffle_agents:
             self.shuffle_agent_mapping()
 
-        obs_gymunity = self.env.reset()
+        while True:
+            try:
+                obs_gymunity = self.env.reset(timeout=self.get_game_timeout())
+                break
+            except UnityEnvCrash as e:
+                self.relaunch(e)
 
         obs_rllib = self.obs_gymunity2rllib(obs_gymunity)
 
+        self.latency_timers.add("reset", time.perf_counter() - reset_start)
+
         return obs_rllib
 
     def step(self, actions_rllib):
 
-        # actions_rllib to actions_gymunity
-        actions_gymunity = self.actions_rllib2gymunity(actions_rllib)
+        step_start = time.perf_counter()
+
+        actions_gymunity = self.before_step(actions_rllib)
+
+        # step forward (gym_unity), in the communicator thread if the game is supervised
+        if self.get_game_timeout() is None:
+            obs_gymunity, rewards_gymunity, dones_gymunity, infos_gymunity = self.env.step_repeat(
+                actions_gymunity, self.action_repeat
+            )
+            returns_rllib = self.after_step(
+                obs_gymunity, rewards_gymunity, dones_gymunity, infos_gymunity
+            )
+        else:
+            self.env.step_async(actions_gymunity, self.action_repeat)
+            returns_rllib = self.step_wait()
+
+        self.latency_timers.add("step", time.perf_counter() - step_start)
+
+        return returns_rllib
+
+    def step_async(self, actions_rllib):
+        """Send actions_rllib to the game without waiting for the game to step forward.
+        The returns of this step are obtained by step_wait,
+        so that other work can be done while the game is stepping forward.
+        """
+
+        actions_gymunity = self.before_step(actions_rllib)
 
-        # step forward (gym_unity)
-        obs_gymunity, rewards_gymunity, dones_gymunity, infos_gymunity = self.env.step(
-            actions_gymunity
+        # step forward (gym_unity) in the background
+        self.env.step_async(actions_gymunity, self.action_repeat)
+
+    def step_wait(self):
+        """Wait for the step sent by step_async and return its returns_rllib.
+        """
+
+        try:
+            obs_gymunity, rewards_gymunity, dones_gymunity, infos_gymunity = self.env.step_wait(
+                timeout=self.get_game_timeout()
+            )
+        except UnityEnvCrash as e:
+            self.relaunch(e)
+            return self.truncate_episode()
+
+        self.consecutive_relaunches = 0
+
+        return self.after_step(
+            obs_gymunity, rewards_gymunity, dones_gymunity, infos_gymunity
         )
 
+    def before_step(self, actions_rllib):
+        """Process actions_rllib before a step, return actions_gymunity.
+        """
+
+        # a step invalidates the obs of the auto reset
+        self.pending_reset_obs = None
+
+        self.launch()
+
+        # actions_rllib to actions_gymunity
+        return self.actions_rllib2gymunity(actions_rllib)
+
+    def after_step(self, obs_gymunity, rewards_gymunity, dones_gymunity, infos_gymunity):
+        """Process returns_gymunity of a step, return returns_rllib.
+        """
+
         # returns_gymunity to returns_rllib
         obs_rllib, rewards_rllib, dones_rllib, infos_rllib = self.returns_gymunity2rllib(
             obs_gymunity, rewards_gymunity, dones_gymunity, infos_gymunity
         )
 
         # auto reset (rllib)
-        if dones_rllib["__all__"] and IS_AUTO_RESET:
+        if dones_rllib["__all__"] and self.is_auto_reset:
             obs_rllib = self.reset()
+            self.pending_reset_obs = obs_rllib
 
         return obs_rllib, rewards_rllib, dones_rllib, infos_rllib
 
@@ -254,42 +1398,78 @@ class ArenaRllibEnv(MultiAgentEnv):
         obs_gymunity: [sensor, multiple agents, (multiple visual observations,), ...]
         """
 
+        if self.is_reuse_obs_buffers:
+            obs_buffers = self.obs_buffers[self.obs_buffers_i]
+            obs_buffers_views = self.obs_buffers_views[self.obs_buffers_i]
+            flat_obs = self.flat_obs_buffers[self.obs_buffers_i]
+            self.obs_buffers_i = (
+                self.obs_buffers_i + 1
+            ) % self.obs_buffers_depth
+        elif self.is_flatten_obs:
+            flat_obs, obs_buffers, obs_buffers_views = self.allocate_obs_buffer()
+
+        obs_all_agents = {}
+        for spec_i, (obs_key, sensor_type, camera_i, gather_index, dimension_to_cat, is_compact) in enumerate(self.obs_gather_specs):
+            # [sensor, multiple agents, (multiple visual observations,), ...]
+            # get sensor
+            obs_ = obs_gymunity[sensor_type]
+            # [multiple agents, (multiple visual observations,), ...]
+            # for visual observations, take one out
+            if camera_i is not None:
+                obs_ = obs_[:, camera_i]
+            # [multiple agents, ...]
+            if is_compact:
+                # stack obs of all agents once, shared by all agents with their own gather_index
+                if self.is_reuse_obs_buffers:
+                    np.copyto(obs_buffers[spec_i], obs_, casting="unsafe")
+                    stacked = obs_buffers[spec_i]
+                else:
+                    stacked = np.array(obs_)
+                obs_all_agents[obs_key] = [
+                    {
+                        "stacked": stacked,
+                        "gather_index": gather_index[agent_i_gymunity],
+                    } for agent_i_gymunity in range(self.number_agents)
+                ]
+                continue
+            # take other agents obs according to agent_i_gymunity_mapping, for all agents at once
+            if self.is_reuse_obs_buffers or self.is_flatten_obs:
+                np.take(
+                    np.asarray(
+                        obs_, dtype=obs_buffers[spec_i].dtype
+                    ),
+                    gather_index,
+                    axis=0,
+                    out=obs_buffers_views[spec_i],
+                    mode="clip",
+                )
+                obs_all_agents[obs_key] = obs_buffers[spec_i]
+            else:
+                obs_all_agents[obs_key] = gather_multi_agent_obs(
+                    obs_,
+                    gather_index=gather_index,
+                    dimension_to_cat=dimension_to_cat,
+                )
+            # [multiple agents, ..., selected multiple agents, ...]
+
         obs = {}
-        for agent_i_gymunity in range(self.number_agents):
-            agent_i_rllib = self.agent_i_gymunity2rllib[agent_i_gymunity]
-            agent_id_rllib = agent_i2id(agent_i_rllib)
-            obs[agent_id_rllib] = {}
-            for multi_agent_ob in self.multi_agent_obs:
-                for sensor in self.sensors:
-                    # [sensor, multiple agents, (multiple visual observations,), ...]
-                    # get sensor
-                    obs_ = obs_gymunity[
-                        sensor.split("_")[0]
-                    ]
-                    # [multiple agents, (multiple visual observations,), ...]
-                    # for visual observations, take one out
-                    if sensor.split("_")[0] == "visual":
-                        obs_ = obs_[
-                            :, SENSOR2CAMERA[sensor]
-                        ]
-                    # [multiple agents, ...]
-                    # take other agents obs according to agent_i_gymunity_mapping
-                    obs_ = np.take(
-                        obs_,
-                        indices=self.agent_i_gymunity_mapping[multi_agent_ob][agent_i_gymunity],
-                        axis=0,
-                    )
-                    # [selecyed multiple agents, ...]
-                    obs_ = np.concatenate(
-                        obs_,
-                        axis=self.dimension_to_cat_multi_agent_obs_for_sensor[sensor],
-                    )
-                    # [..., selecyed multiple agents, ...]
-                    obs[agent_id_rllib]["{}-{}".format(
-                        multi_agent_ob,
-                        sensor,
-                    )] = obs_
-            obs[agent_id_rllib] = try_reduce_dict(obs[agent_id_rllib])
+        if self.is_flatten_obs:
+            for agent_i_gymunity, agent_id_rllib in enumerate(self.agent_ids_gymunity):
+                obs[agent_id_rllib] = flat_obs[agent_i_gymunity]
+        elif len(self.obs_gather_specs) == 1:
+            obs_all_agents = obs_all_agents[self.obs_gather_specs[0][0]]
+            for agent_i_gymunity, agent_id_rllib in enumerate(self.agent_ids_gymunity):
+                obs[agent_id_rllib] = obs_all_agents[agent_i_gymunity]
+        else:
+            for agent_i_gymunity, agent_id_rllib in enumerate(self.agent_ids_gymunity):
+                obs[agent_id_rllib] = {
+                    obs_key: obs_all_agents[obs_key][agent_i_gymunity] for obs_key in obs_all_agents.keys()
+                }
+
+        if self.shared_memory is not None:
+            obs = self.to_shared_memory_obs(obs)
+
+        self.last_obs_rllib = obs
 
         return obs
 
@@ -297,17 +1477,28 @@ class ArenaRllibEnv(MultiAgentEnv):
         """Process returns_gymunity to returns_rllib.
         """
 
+        convert_start = time.perf_counter()
         obs_rllib = self.obs_gymunity2rllib(obs_gymunity)
+        self.latency_timers.add(
+            "obs_gymunity2rllib", time.perf_counter() - convert_start
+        )
 
-        rewards_rllib = {}
-        dones_rllib = {}
-        infos_rllib = {}
-        for agent_i_gymunity in range(self.number_agents):
-            agent_i_rllib = self.agent_i_gymunity2rllib[agent_i_gymunity]
-            agent_id_rllib = agent_i2id(agent_i_rllib)
-            rewards_rllib[agent_id_rllib] = rewards_gymunity[agent_i_gymunity]
-            dones_rllib[agent_id_rllib] = dones_gymunity[agent_i_gymunity]
-            infos_rllib[agent_id_rllib] = infos_gymunity
+        rewards_rllib = dict(zip(self.agent_ids_gymunity, rewards_gymunity))
+        dones_rllib = dict(zip(self.agent_ids_gymunity, dones_gymunity))
+        if self.infos_mode in ["full"]:
+            infos_rllib = dict.fromkeys(self.agent_ids_gymunity, infos_gymunity)
+        elif self.infos_mode in ["slim"]:
+            brain_info = infos_gymunity["brain_info"]
+            infos_rllib = {}
+            for agent_i_gymunity, agent_id_rllib in enumerate(self.agent_ids_gymunity):
+                infos_rllib[agent_id_rllib] = {
+                    "text_observation": brain_info.text_observations[agent_i_gymunity],
+                    "max_reached": bool(brain_info.max_reached[agent_i_gymunity]),
+                }
+        elif self.infos_mode in ["none"]:
+            infos_rllib = {
+                agent_id_rllib: {} for agent_id_rllib in self.agent_ids_gymunity
+            }
 
         # done when all agents are done
         dones_rllib["__all__"] = np.all(dones_gymunity)
@@ -317,40 +1508,171 @@ class ArenaRllibEnv(MultiAgentEnv):
     def actions_rllib2gymunity(self, actions_rllib):
         """Process actions_rllib to actions_gymunity.
         """
-        actions_gymunity = [None] * self.number_agents
-        for agent_i_rllib in range(self.number_agents):
-            agent_id_rllib = agent_i2id(agent_i_rllib)
-            agent_i_gymunity = self.agent_i_rllib2gymunity[agent_i_rllib]
-            actions_gymunity[agent_i_gymunity] = actions_rllib[agent_id_rllib]
-        return actions_gymunity
+        return [actions_rllib[agent_id_rllib] for agent_id_rllib in self.agent_ids_gymunity]
 
     def render(self, mode="rgb_array"):
+        self.launch()
         return self.env.render(mode)
 
+    # the following are the same for all games (as in UnityEnv), so they are answered without launching the game
+
     @property
     def metadata(self):
-        return self.env.metadata
+        return {"render.modes": ["rgb_array"]}
 
     @property
     def reward_range(self):
-        return self.env.reward_range
-
-    @property
-    def metadata(self):
-        return self.env.metadata
+        return -float("inf"), float("inf")
 
     @property
     def spec(self):
-        return self.env.spec
+        return None
 
     def close(self):
-        self.env.close()
+        if self.env is not None:
+            self.env.close()
+            release_unity_rank(self.rank)
+            self.env = None
+        # a shared StandbyPool is closed by its owner, see ArenaVectorEnv.stop
+        if self.is_own_standby_pool:
+            self.standby_pool.close()
+            self.standby_pool = None
+            self.is_own_standby_pool = False
+        if self.shared_memory is not None:
+            # the views mapped by the rollout worker stay valid after removing the file
+            self.shared_memory = None
+            try:
+                os.remove(self.shared_memory_path)
+            except FileNotFoundError:
+                pass
 
     @property
     def unwrapped(self):
         return self
 
 
+class ArenaVectorEnv(_MultiAgentEnvToBaseEnv):
+    """arena-spec: vectorized ArenaRllibEnv (BaseEnv), which steps multiple game instances concurrently.
+
+        _MultiAgentEnvToBaseEnv steps the envs one after another, the worker sits idle while each game simulates.
+        ArenaVectorEnv sends actions to all game instances at once and waits for all of them,
+        so that the simulations of the game instances overlap.
+    """
+
+    def __init__(self, make_env, existing_envs, num_envs):
+        super(ArenaVectorEnv, self).__init__(
+            make_env=make_env,
+            existing_envs=existing_envs,
+            num_envs=num_envs,
+        )
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.num_envs
+        )
+
+        # one hot spare for all envs, instead of one per env, see ArenaRllibEnv.recycle
+        self.standby_pool = None
+        hot_spare_envs = [
+            env.unwrapped for env in self.envs
+            if isinstance(env.unwrapped, ArenaRllibEnv) and env.unwrapped.is_hot_spare
+        ]
+        if len(hot_spare_envs) > 0:
+            self.standby_pool = StandbyPool()
+            for env in hot_spare_envs:
+                env.set_standby_pool(self.standby_pool)
+
+    @override(BaseEnv)
+    def poll(self):
+        # reset envs at their first poll concurrently
+        env_states_to_initialize = [
+            env_state for env_state in self.env_states if not env_state.initialized
+        ]
+        for _ in self.executor.map(
+            lambda env_state: env_state.reset(),
+            env_states_to_initialize,
+        ):
+            pass
+        for env_state in env_states_to_initialize:
+            env_state.initialized = True
+
+        return super(ArenaVectorEnv, self).poll()
+
+    @override(BaseEnv)
+    def send_actions(self, action_dict):
+        for env_id in action_dict.keys():
+            if env_id in self.dones:
+                raise ValueError("Env {} is already done".format(env_id))
+
+        env_ids = list(action_dict.keys())
+        returns = self.executor.map(
+            lambda env_id: self.envs[env_id].step(action_dict[env_id]),
+            env_ids,
+        )
+
+        # the same checks as _MultiAgentEnvToBaseEnv.send_actions, on the returns of all envs
+        for env_id, (obs, rewards, dones, infos) in zip(env_ids, returns):
+            assert isinstance(obs, dict), "Not a multi-agent obs"
+            assert isinstance(rewards, dict), "Not a multi-agent reward"
+            assert isinstance(dones, dict), "Not a multi-agent return"
+            assert isinstance(infos, dict), "Not a multi-agent info"
+            if set(obs.keys()) != set(rewards.keys()):
+                raise ValueError(
+                    "Key set for obs and rewards must be the same: "
+                    "{} vs {}".format(obs.keys(), rewards.keys()))
+            if set(infos).difference(set(obs)):
+                raise ValueError("Key set for infos must be a subset of obs: "
+                                 "{} vs {}".format(infos.keys(), obs.keys()))
+            if "__all__" not in dones:
+                raise ValueError(
+                    "In multi-agent environments, '__all__': True|False must "
+                    "be included in the 'done' dict: got {}.".format(dones))
+            if dones["__all__"]:
+                self.dones.add(env_id)
+            self.env_states[env_id].observe(obs, rewards, dones, infos)
+
+    @override(BaseEnv)
+    def stop(self):
+        self.executor.shutdown()
+        super(ArenaVectorEnv, self).stop()
+        if self.standby_pool is not None:
+            self.standby_pool.close()
+
+
+class SharedMemoryObsEnv(BaseEnv):
+    """Wrap a BaseEnv of remote ArenaRllibEnv with is_shared_memory_obs,
+    resolving the SharedMemoryObs returned by them into views of the shared memory,
+    which are valid for obs_buffers_depth steps, see ArenaRllibEnv.allocate_obs_buffers.
+    """
+
+    def __init__(self, base_env):
+        self.base_env = base_env
+        self.shared_memories = {}
+
+    @override(BaseEnv)
+    def poll(self):
+        obs, rewards, dones, infos, off_policy_actions = self.base_env.poll()
+        return resolve_shared_memory_obs(
+            obs, self.shared_memories
+        ), rewards, dones, infos, off_policy_actions
+
+    @override(BaseEnv)
+    def send_actions(self, action_dict):
+        self.base_env.send_actions(action_dict)
+
+    @override(BaseEnv)
+    def try_reset(self, env_id):
+        return resolve_shared_memory_obs(
+            self.base_env.try_reset(env_id), self.shared_memories
+        )
+
+    @override(BaseEnv)
+    def get_unwrapped(self):
+        return self.base_env.get_unwrapped()
+
+    @override(BaseEnv)
+    def stop(self):
+        self.base_env.stop()
+
+
 class ArenaUnityEnv(UnityEnv):
     """An override of UnityEnv from gym_unity.envs, to fix some of their bugs and add some supports.
     Search "arena-spec" for these places.
@@ -358,22 +1680,82 @@ class ArenaUnityEnv(UnityEnv):
 
     def __init__(self, *args, **kwargs):
         """arena-spec: add support for multiple sensors, observation_space is modified to be a dict
+
+        Additional keyword arguments:
+            cameras: list of camera_i to receive visual observations from (in this order), None for all cameras.
+                The visual observations skip the other cameras, and are None if cameras is empty.
+            decode_threads: number of threads decoding the visual observations,
+                0 to decode them in the thread calling step.
+            simulated_config: if not None, SimulatedUnityEnvironment (simulated.py) configured by it
+                is created instead of launching the game.
         """
-        super(ArenaUnityEnv, self).__init__(*args, **kwargs)
+        self.cameras = kwargs.pop("cameras", None)
+        decode_threads = kwargs.pop("decode_threads", DECODE_THREADS)
+        simulated_config = kwargs.pop("simulated_config", None)
+        # UnityEnv only keeps uint8_visual when use_visual is True, so it is kept here
+        uint8_visual = kwargs.pop("uint8_visual", False)
+
+        # arena-spec: visual observations are decoded in _preprocess_multi, see defer_visual_observation_decoding
+        if decode_threads > 0:
+            self.decode_executor = ThreadPoolExecutor(
+                max_workers=decode_threads
+            )
+        else:
+            self.decode_executor = None
+
+        if simulated_config is None:
+            super(ArenaUnityEnv, self).__init__(*args, **kwargs)
+        else:
+            # UnityEnv creates the UnityEnvironment of gym_unity.envs, which is swapped meanwhile
+            with SIMULATED_BACKEND_LOCK:
+                unity_environment = gym_unity.envs.UnityEnvironment
+                gym_unity.envs.UnityEnvironment = functools.partial(
+                    SimulatedUnityEnvironment, **simulated_config
+                )
+                try:
+                    super(ArenaUnityEnv, self).__init__(*args, **kwargs)
+                finally:
+                    gym_unity.envs.UnityEnvironment = unity_environment
+
+        self.uint8_visual = uint8_visual
+
+        # arena-spec: steps sent by step_async run in this background communicator thread
+        self.communicator_executor = ThreadPoolExecutor(max_workers=1)
+        self.pending_step = None
+
+        # arena-spec: preallocated by _preprocess_multi at the first visual observation
+        self.visual_obs_buffer = None
+
+        # arena-spec: latencies of the game and of the visual preprocessing
+        self.latency_timers = LatencyTimers()
+        self.preprocess_time = 0.0
+
+        # arena-spec: set by step_repeat, so that the visual observations of the repeated steps are not preprocessed
+        self.is_skip_visual_preprocess = False
+
+        # arena-spec: preallocated by render at the first call
+        self.render_canvas = None
 
         brain = self._env.brains[self.brain_name]
 
+        if self.cameras is None:
+            self.cameras = list(range(len(brain.camera_resolutions)))
+
         self._observation_space = {}
 
-        for camera_i in range(len(brain.camera_resolutions)):
+        for camera_i in self.cameras:
             if brain.camera_resolutions[camera_i]["blackAndWhite"]:
                 depth = 1
             else:
                 depth = 3
+            if self.uint8_visual:
+                low, high, dtype = 0, 255, np.uint8
+            else:
+                low, high, dtype = 0, 1, np.float32
             self._observation_space[CAMERA2SENSOR[camera_i]] = spaces.Box(
-                0,
-                1,
-                dtype=np.float32,
+                low,
+                high,
+                dtype=dtype,
                 shape=(
                     brain.camera_resolutions[camera_i]["height"],
                     brain.camera_resolutions[camera_i]["width"],
@@ -385,34 +1767,177 @@ class ArenaUnityEnv(UnityEnv):
         self._observation_space['vector'] = spaces.Box(
             -high, high, dtype=np.float32)
 
-    def _preprocess_multi(self, multiple_visual_obs):
-        """arena-spec: ml-agent does not support multiple agents & multiple obs
+    def step(self, action):
+        """arena-spec: time the step of the game, excluding the visual preprocessing
         """
+        step_start = time.perf_counter()
+        self.preprocess_time = 0.0
+        returns = super(ArenaUnityEnv, self).step(action)
+        self.latency_timers.add(
+            "unity_step", time.perf_counter() - step_start - self.preprocess_time
+        )
+        return returns
 
-        multiple_visual_obs = np.asarray(multiple_visual_obs)
-        # (multiple visual obs, multiple agents, 84, 84, 1)
+    def _preprocess_multi(self, multiple_visual_obs):
+        """arena-spec: ml-agent does not support multiple agents & multiple obs.
+        Frames are decoded (concurrently by decode_executor) straight into visual_obs_buffer of shape
+        (multiple agents, multiple visual obs, 84, 84, 1), in the dtype of the visual observation space.
+        The buffer is reused across steps, so the returned array is only valid until the next step.
+        """
 
-        multiple_visual_obs = np.transpose(
-            multiple_visual_obs,
-            axes=(1, 0, 2, 3, 4),
+        is_encoded = isinstance(
+            multiple_visual_obs[0][0], EncodedVisualObservation
         )
-        # (multiple agents, multiple visual obs, 84, 84, 1)
+        if is_encoded:
+            # all cameras have the same resolution
+            frame_shape = self._observation_space[
+                CAMERA2SENSOR[self.cameras[0]]
+            ].shape
+        else:
+            frame_shape = np.shape(multiple_visual_obs[0][0])
+        buffer_shape = (
+            len(multiple_visual_obs[0]), len(multiple_visual_obs),
+        ) + frame_shape
+
+        if (self.visual_obs_buffer is None) or (self.visual_obs_buffer.shape != buffer_shape):
+            self.visual_obs_buffer = np.empty(
+                buffer_shape,
+                dtype=np.uint8 if self.uint8_visual else np.float32,
+            )
 
-        if self.uint8_visual:
-            multiple_visual_obs = (
-                255.0 * multiple_visual_obs
-            ).astype(np.uint8)
+        if is_encoded:
+            frames = [
+                (frame, self.visual_obs_buffer[agent_i, visual_obs_i])
+                for visual_obs_i, visual_obs in enumerate(multiple_visual_obs)
+                for agent_i, frame in enumerate(visual_obs)
+            ]
+            if self.decode_executor is not None:
+                for _ in self.decode_executor.map(
+                    lambda frame: decode_visual_observation(*frame),
+                    frames,
+                ):
+                    pass
+            else:
+                for frame in frames:
+                    decode_visual_observation(*frame)
+            return self.visual_obs_buffer
+
+        for visual_obs_i, visual_obs in enumerate(multiple_visual_obs):
+            for agent_i, frame in enumerate(visual_obs):
+                if self.uint8_visual:
+                    # scale and cast in one pass, without a float64 temporary of the whole batch
+                    np.multiply(
+                        frame, 255.0,
+                        out=self.visual_obs_buffer[agent_i, visual_obs_i],
+                        casting="unsafe",
+                    )
+                else:
+                    self.visual_obs_buffer[agent_i, visual_obs_i] = frame
 
-        return multiple_visual_obs
+        return self.visual_obs_buffer
 
     # arena-spec
     def set_train_mode(self, train_mode):
         self.train_mode = train_mode
 
-    def reset(self):
-        """arena-spec: add support for train_mode=self.train_mode
+    def step_repeat(self, action, action_repeat):
+        """arena-spec: repeat action for action_repeat steps, stopping early when any agent is done.
+        Returns the returns of the last step, except that the rewards are summed over the steps.
+        """
+        if action_repeat <= 1:
+            return self.step(action)
+
+        # the visual observations of all but the last step are dropped,
+        # so they are only preprocessed for the last step, which is known after stepping
+        self.is_skip_visual_preprocess = True
+        try:
+            obs, reward, done, info = self.step(action)
+            reward = np.asarray(reward, dtype=np.float64)
+            for _ in range(action_repeat - 1):
+                if any(done):
+                    break
+                obs, reward_repeat, done, info = self.step(action)
+                reward += reward_repeat
+        finally:
+            self.is_skip_visual_preprocess = False
+        obs["visual"] = self.preprocess_visual_obs(info["brain_info"])
+        return obs, reward.tolist(), done, info
+
+    def step_async(self, action, action_repeat=1):
+        """arena-spec: step forward (see step_repeat) in the background communicator thread without blocking,
+        the returns are obtained by step_wait
+        """
+        if self.pending_step is not None:
+            raise Exception(
+                "step_async is called while the last step is pending, call step_wait first"
+            )
+        self.pending_step = self.communicator_executor.submit(
+            self.step_repeat, action, action_repeat
+        )
+
+    def step_wait(self, timeout=None):
+        """arena-spec: wait for the step sent by step_async and return its returns,
+        if timeout is not None, raise UnityEnvCrash when the game exits or takes longer than timeout seconds
+        """
+        if self.pending_step is None:
+            raise Exception(
+                "step_wait is called without step_async"
+            )
+        pending_step = self.pending_step
+        self.pending_step = None
+        if timeout is None:
+            return pending_step.result()
+        return self.supervise(pending_step, timeout)
+
+    def is_alive(self):
+        """arena-spec: check if the process of the game is still running (always True for the simulated backend)
+        """
+        proc = getattr(self._env, "proc1", None)
+        return (proc is None) or (proc.poll() is None)
+
+    def supervise(self, future, timeout):
+        """arena-spec: wait for future of a call to the game in the communicator thread and return its result,
+        raise UnityEnvCrash when the game exits or takes longer than timeout seconds.
+        The communicator waits for the game forever, so a dead game is only noticed by polling its process.
         """
+        wait_start = time.perf_counter()
+        while True:
+            try:
+                return future.result(timeout=SUPERVISOR_POLL_INTERVAL)
+            except FuturesTimeoutError:
+                if not self.is_alive():
+                    raise UnityEnvCrash("The game exited with code {}".format(
+                        self._env.proc1.poll(),
+                    ))
+                if time.perf_counter() - wait_start > timeout:
+                    raise UnityEnvCrash("The game is unresponsive for {} seconds".format(
+                        timeout,
+                    ))
+            except Exception as e:
+                if not self.is_alive():
+                    raise UnityEnvCrash("The game exited with code {}: {}".format(
+                        self._env.proc1.poll(),
+                        e,
+                    ))
+                raise
+
+    def reset(self, timeout=None):
+        """arena-spec: add support for train_mode=self.train_mode,
+        if timeout is not None, raise UnityEnvCrash when the game exits or takes longer than timeout seconds
+        """
+        if self.pending_step is not None:
+            raise Exception(
+                "reset is called while a step is pending, call step_wait first"
+            )
+        if timeout is not None:
+            return self.supervise(
+                self.communicator_executor.submit(self.reset), timeout
+            )
+        reset_start = time.perf_counter()
         info = self._env.reset(train_mode=self.train_mode)[self.brain_name]
+        self.latency_timers.add(
+            "unity_reset", time.perf_counter() - reset_start
+        )
         n_agents = len(info.agents)
         self._check_agents(n_agents)
         self.game_over = False
@@ -427,8 +1952,10 @@ class ArenaUnityEnv(UnityEnv):
         """arena-spec: add support for returning both vector observations and visual observations
         """
         default_observation = {}
-        self.visual_obs = self._preprocess_multi(info.visual_observations)
-        default_observation["visual"] = self.visual_obs
+        if self.is_skip_visual_preprocess:
+            default_observation["visual"] = None
+        else:
+            default_observation["visual"] = self.preprocess_visual_obs(info)
         default_observation["vector"] = info.vector_observations
         return (
             default_observation,
@@ -437,46 +1964,80 @@ class ArenaUnityEnv(UnityEnv):
             {"text_observation": info.text_observations, "brain_info": info},
         )
 
+    def preprocess_visual_obs(self, info):
+        """arena-spec: preprocess the visual observations of the cameras in info (BrainInfo) into self.visual_obs
+        """
+        if len(self.cameras) > 0:
+            preprocess_start = time.perf_counter()
+            self.visual_obs = self._preprocess_multi(
+                [info.visual_observations[camera_i] for camera_i in self.cameras]
+            )
+            self.preprocess_time = time.perf_counter() - preprocess_start
+            self.latency_timers.add("visual_preprocess", self.preprocess_time)
+        else:
+            self.visual_obs = None
+        return self.visual_obs
+
     def _single_step(self, info):
         raise NotImplementedError
 
-    def render(self, mode="rgb_array"):
-        """arena-spec: add support for rendering visual_obs of multiple agents and multiple cameras into one grided rendered frame
+    def close(self, is_crashed=False):
+        """arena-spec: also stop the background communicator thread and the decoding threads,
+        without waiting for them if the game is_crashed, since the communicator thread might be blocked on the game
         """
+        self.communicator_executor.shutdown(wait=not is_crashed)
+        if self.decode_executor is not None:
+            self.decode_executor.shutdown(wait=not is_crashed)
+        super(ArenaUnityEnv, self).close()
+        if is_crashed:
+            # the communicator thread blocked on receiving from the game is released by closing the other end
+            child_conn = getattr(
+                getattr(getattr(self._env, "communicator", None), "unity_to_external", None),
+                "child_conn",
+                None,
+            )
+            if child_conn is not None:
+                child_conn.close()
 
-        logger.info("rendering")
+    def render(self, mode="rgb_array"):
+        """arena-spec: add support for rendering visual_obs of multiple agents and multiple cameras into one grided rendered frame.
+        The frame is a uint8 canvas reused across calls, so it is only valid until the next call.
+        """
 
         if mode in ['rgb_array']:
 
             if len(np.shape(self.visual_obs)) == 5:
                 # (multiple agents, multiple visual obs, 84, 84, 1)
 
-                frame = self.visual_obs
-
-                # convert to uint8
-                if frame.dtype != np.uint8:
-                    frame = (255.0 * frame).astype(np.uint8)
-
-                # reshape to (multiple_img, img_shape)
-                frame = np.reshape(
-                    frame,
-                    newshape=(-1,) + np.shape(self.visual_obs)[2:],
+                number_agents, number_visual_obs, height, width, _ = np.shape(
+                    self.visual_obs
                 )
 
-                # convert to rgb
-                if np.shape(frame)[-1] == 1:
-                    frame = np.concatenate(
-                        [frame] * 3,
-                        axis=3,
+                # same layout as gallery with ncols=number_agents,
+                # i.e., the visual obs are gridded in their flattened order, number_agents in a row
+                nrows = number_visual_obs
+                ncols = number_agents
+                canvas_shape = (height * nrows, width * ncols, 3)
+                if (self.render_canvas is None) or (self.render_canvas.shape != canvas_shape):
+                    self.render_canvas = np.empty(
+                        canvas_shape, dtype=np.uint8
                     )
 
-                # grid them to make it a gallery single img
-                frame = gallery(
-                    frame,
-                    ncols=self.number_agents,
+                # (nrows, ncols, 84, 84, 1) to (nrows, 84, ncols, 84, 1), matching the view of the canvas,
+                # gray scale is converted to rgb by broadcasting
+                frame = np.reshape(
+                    self.visual_obs,
+                    (nrows, ncols) + np.shape(self.visual_obs)[2:],
+                ).swapaxes(1, 2)
+                canvas = self.render_canvas.reshape(
+                    nrows, height, ncols, width, 3
                 )
+                if frame.dtype == np.uint8:
+                    np.copyto(canvas, frame)
+                else:
+                    np.multiply(frame, 255.0, out=canvas, casting="unsafe")
 
-                return frame
+                return self.render_canvas
 
             else:
                 raise NotImplementedError
@@ -500,6 +2061,33 @@ def get_env_directory(env_id):
     }[platform.system()]
 
 
+def get_env_binary_signature(env_id):
+    """Get (path, mtime, size) of each game build of env_id, to tell if the game has been rebuilt.
+    """
+    game_file_path, extension_name = get_env_directory(env_id)
+    signature = []
+    for build_file_path in [game_file_path, game_file_path + '-Server']:
+        if os.path.exists(build_file_path + extension_name):
+            stat = os.stat(build_file_path + extension_name)
+            signature += [
+                (build_file_path + extension_name, stat.st_mtime, stat.st_size)
+            ]
+    return signature
+
+
+def get_spaces_cache_key(env_id, env_config):
+    """Get the key identifying the spaces of ArenaRllibEnv(env_id, env_config) in the metadata cache.
+    """
+    return {
+        "version": SPACES_CACHE_VERSION,
+        "env_id": env_id,
+        "binary": get_env_binary_signature(env_id),
+        "env_config": dict(
+            [(key, env_config.get(key, None)) for key in SPACES_ENV_CONFIG_KEYS]
+        ),
+    }
+
+
 def is_arena_env(each_env):
     """Check if a env (string) is an arena env.
     """
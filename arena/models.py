@@ -4,6 +4,7 @@ from ray.rllib.models.tf.tf_action_dist import Categorical
 from ray.rllib.utils.annotations import override
 from ray.rllib.models import Model, ModelCatalog
 from ray.rllib.models.tf.tf_modelv2 import TFModelV2
+from ray.rllib.models.tf.visionnet_v1 import VisionNetwork
 from ray.rllib.utils import try_import_tf
 
 tf = try_import_tf()
@@ -20,6 +21,84 @@ class DeterministicCategorical(Categorical):
         return tf.squeeze(tf.argmax(self.inputs, 1), axis=1)
 
 
+def gather_compact_multi_agent_obs(compact_obs, dimension_to_cat):
+    """Reconstruct in a model the observation of a multi_agent_ob emitted in the compact form
+    (env_config.is_compact_multi_agent_obs), as it is emitted when not in the compact form.
+
+    Arguments:
+        compact_obs: dict of "stacked" of shape (batch, number_agents, ...)
+            and "gather_index" of shape (batch, number_selected_agents)
+        dimension_to_cat: the dimension (of a single observation) at which the
+            observations of selected agents are concatenated, 2 for visual sensors and 0 for vector sensor
+    Returns:
+        of shape (batch, ...), where the dimension_to_cat of a single
+        observation is number_selected_agents times larger
+    """
+    # (batch, number_selected_agents, ...)
+    obs = tf.gather(
+        compact_obs["stacked"],
+        tf.cast(compact_obs["gather_index"], tf.int32),
+        batch_dims=1,
+    )
+    # (batch, ..., number_selected_agents, dimension_to_cat, ...)
+    rank = len(obs.shape)
+    obs = tf.transpose(
+        obs,
+        [0] + list(range(2, dimension_to_cat + 2)) +
+        [1] + list(range(dimension_to_cat + 2, rank)),
+    )
+    shape = obs.shape.as_list()
+    return tf.reshape(
+        obs,
+        [-1] + shape[1:dimension_to_cat + 1] +
+        [shape[dimension_to_cat + 1] * shape[dimension_to_cat + 2]] +
+        shape[dimension_to_cat + 3:]
+    )
+
+
+def split_flat_obs(flat_obs, flat_obs_offsets):
+    """Split in a model the flat observation (env_config.is_flatten_obs) into a dict of multi_agent_ob-sensor.
+
+    Arguments:
+        flat_obs: of shape (batch, flat_obs_size)
+        flat_obs_offsets: flat_obs_offsets[multi_agent_ob-sensor] is (start, end, shape)
+            of the multi_agent_ob-sensor in flat_obs, see ArenaRllibEnv
+    Returns:
+        dict of multi_agent_ob-sensor, each is of shape (batch,) + shape
+    """
+    return {
+        obs_key: tf.reshape(
+            flat_obs[:, start:end],
+            [-1] + list(shape),
+        ) for obs_key, (start, end, shape) in flat_obs_offsets.items()
+    }
+
+
+def get_obs_dict(obs, custom_options):
+    """Get in a model the observation as a dict of multi_agent_ob-sensor,
+    splitting the flat observation (env_config.is_flatten_obs) with split_flat_obs
+    if flat_obs_offsets is in custom_options (see expand_exp), otherwise obs is returned as it is.
+    """
+    flat_obs_offsets = (custom_options or {}).get("flat_obs_offsets", None)
+    if flat_obs_offsets is not None:
+        return split_flat_obs(obs, flat_obs_offsets)
+    return obs
+
+
+class ArenaVisionNetwork(VisionNetwork):
+    """VisionNetwork for uint8 visual observations (env_config.is_uint8_visual),
+    which are normalized to [0,1] inside the model.
+    """
+
+    @override(VisionNetwork)
+    def _build_layers_v2(self, input_dict, num_outputs, options):
+        input_dict = dict(input_dict)
+        input_dict["obs"] = tf.cast(input_dict["obs"], tf.float32) / 255.0
+        return super(ArenaVisionNetwork, self)._build_layers_v2(
+            input_dict, num_outputs, options
+        )
+
+
 class ArenaPolicy(TFModelV2):
     """Multi-agent policy that supports:
     1, weights sharing between policies;
@@ -47,8 +126,11 @@ class ArenaPolicy(TFModelV2):
         self._value_out, _ = self.value_model({
             "obs": input_dict["obs_flat"]
         }, state, seq_lens)
+        obs = get_obs_dict(
+            input_dict["obs"], self.model_config.get("custom_options", None)
+        )
         return self.action_model({
-            "obs": input_dict["obs"]["own_obs"]
+            "obs": obs["own_obs"]
         }, state, seq_lens)
 
     def value_function(self):
@@ -90,3 +172,4 @@ class ArenaPolicy(TFModelV2):
 
 
 ModelCatalog.register_custom_model("ArenaPolicy", ArenaPolicy)
+ModelCatalog.register_custom_model("ArenaVisionNetwork", ArenaVisionNetwork)
@@ -1,10 +1,20 @@
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
 from ray.rllib.evaluation.rollout_worker import *
 from ray.rllib.evaluation.rollout_worker import _validate_env, _validate_and_canonicalize, _has_tensorflow_graph
+from ray.rllib.env.base_env import _MultiAgentEnvToBaseEnv
 from gym import wrappers
 
+from .envs import ArenaRllibEnv, ArenaVectorEnv, SharedMemoryObsEnv, is_arena_env
+
 
 class ArenaRolloutWorker(RolloutWorker):
-    """arena-spec, support monitor for MultiAgentEnv
+    """arena-spec, support monitor for MultiAgentEnv,
+    launch the games of all ArenaRllibEnv of the worker at once,
+    step multiple ArenaRllibEnv concurrently with ArenaVectorEnv,
+    and read obs of remote ArenaRllibEnv from shared memory with SharedMemoryObsEnv
     """
 
     @DeveloperAPI
@@ -168,8 +178,31 @@ class ArenaRolloutWorker(RolloutWorker):
         self.last_batch = None
         self._fake_sampler = _fake_sampler
 
+        # arena-spec, launch the games of all envs of this worker at once,
+        # so that the startup costs one launch instead of num_envs launches
+        launch_start = time.time()
+        env = (policy_config or {}).get("env", None)
+        if (num_envs > 1) and (not remote_worker_envs) and isinstance(env, str) and is_arena_env(env):
+            launched_envs = launch_envs(
+                env_creator=env_creator,
+                env_contexts=[
+                    env_context.copy_with_overrides(vector_index=vector_index) for vector_index in range(num_envs)
+                ],
+                # the local worker of a trainer with remote workers never steps its envs,
+                # so their games are left to be launched lazily (i.e., never)
+                is_launch=not ((worker_index == 0) and (policy_config.get("num_workers", 0) > 0)),
+            )
+        else:
+            launched_envs = [env_creator(env_context)]
+        self.startup_time = time.time() - launch_start
+        logger.info("Worker {} launched {} envs in {:.2f} seconds".format(
+            worker_index,
+            len(launched_envs),
+            self.startup_time,
+        ))
+
         # arena-spec
-        self.env = _validate_env(env_creator(env_context).unwrapped)
+        self.env = _validate_env(launched_envs[0].unwrapped)
 
         # arena-spec
         if isinstance(self.env, MultiAgentEnv) or \
@@ -277,13 +310,33 @@ class ArenaRolloutWorker(RolloutWorker):
         if self.worker_index == 0:
             logger.info("Built filter map: {}".format(self.filters))
 
-        # Always use vector env for consistency even if num_envs = 1
-        self.async_env = BaseEnv.to_base_env(
-            self.env,
-            make_env=make_env,
-            num_envs=num_envs,
-            remote_envs=remote_worker_envs,
-            remote_env_batch_wait_ms=remote_env_batch_wait_ms)
+        # arena-spec, step multiple ArenaRllibEnv concurrently
+        if isinstance(self.env, ArenaRllibEnv) and (num_envs > 1) and (not remote_worker_envs):
+            self.async_env = ArenaVectorEnv(
+                make_env=make_env,
+                existing_envs=[self.env] + [
+                    wrap(launched_env) for launched_env in launched_envs[1:]
+                ],
+                num_envs=num_envs)
+        elif len(launched_envs) > 1:
+            # arena-spec, e.g., the envs are wrapped by a monitor
+            self.async_env = _MultiAgentEnvToBaseEnv(
+                make_env=make_env,
+                existing_envs=[self.env] + [
+                    wrap(launched_env) for launched_env in launched_envs[1:]
+                ],
+                num_envs=num_envs)
+        else:
+            # Always use vector env for consistency even if num_envs = 1
+            self.async_env = BaseEnv.to_base_env(
+                self.env,
+                make_env=make_env,
+                num_envs=num_envs,
+                remote_envs=remote_worker_envs,
+                remote_env_batch_wait_ms=remote_env_batch_wait_ms)
+            # arena-spec, remote ArenaRllibEnv return handles to obs in shared memory
+            if isinstance(self.env, ArenaRllibEnv) and remote_worker_envs and env_context.get("is_shared_memory_obs", False):
+                self.async_env = SharedMemoryObsEnv(self.async_env)
         self.num_envs = num_envs
 
         if self.batch_mode == "truncate_episodes":
@@ -358,3 +411,38 @@ class ArenaRolloutWorker(RolloutWorker):
         logger.debug(
             "Created rollout worker with env {} ({}), policies {}".format(
                 self.async_env, self.env, self.policy_map))
+
+
+def launch_envs(env_creator, env_contexts, is_launch=True):
+    """Create an env for each of env_contexts concurrently, and launch their games if is_launch,
+    closing the created ones if any of them fails.
+    """
+
+    def create_and_launch(env_context):
+        env = env_creator(env_context)
+        # the envs of a rollout worker are stepped right away,
+        # so they are launched here (concurrently) instead of lazily at their first reset
+        if is_launch and isinstance(env, ArenaRllibEnv):
+            try:
+                env.launch()
+            except Exception:
+                env.close()
+                raise
+        return env
+
+    with ThreadPoolExecutor(max_workers=len(env_contexts)) as executor:
+        futures = [
+            executor.submit(create_and_launch, env_context) for env_context in env_contexts
+        ]
+    envs = []
+    errors = []
+    for future in futures:
+        try:
+            envs += [future.result()]
+        except Exception as e:
+            errors += [e]
+    if len(errors) > 0:
+        for env in envs:
+            env.close()
+        raise errors[0]
+    return envs
@@ -0,0 +1,202 @@
+import time
+import logging
+
+import cv2
+import numpy as np
+
+from mlagents.envs.brain import BrainInfo, BrainParameters
+
+logger = logging.getLogger(__name__)
+
+SIMULATED_BRAIN_NAME = "SimulatedBrain"
+# in the order of vector_action_space_type of BrainParameters
+VALID_ACTION_SPACE_TYPES = ["discrete", "continuous"]
+SIMULATED_CONFIG = {
+    # number of agents, ArenaRllibEnv sets it from the social config of the env
+    "number_agents": 2,
+    "vector_observation_size": 8,
+    # resolution of each camera, Arena games have two cameras (visual_FP and visual_TP)
+    "number_cameras": 2,
+    "camera_height": 84,
+    "camera_width": 84,
+    "is_black_and_white": True,
+    # "discrete" or "continuous", ArenaRllibEnv sets it from the env
+    "action_space_type": "discrete",
+    # size of each branch for discrete actions, or the size of continuous actions
+    "action_space_size": [7],
+    # number of steps after which all agents are done
+    "episode_length": 100,
+    # seconds the game takes for a step or a reset, simulated by sleeping
+    "step_latency": 0.0,
+    "reset_latency": 0.0,
+    # number of distinct frames (and vector observations) each agent cycles through
+    "number_frames": 8,
+    # send visual observations as PNG images, as the communicator of a game does
+    "is_encode_visual": True,
+    "seed": 0,
+}
+
+
+class SimulatedUnityEnvironment(object):
+    """A stand-in of UnityEnvironment of mlagents in pure numpy, with the surface used by ArenaUnityEnv,
+    so that the wrappers can be profiled without launching a game (env_config.backend="simulated").
+
+    Observations are taken from pregenerated random frames and vector observations,
+    rewards are random, and all agents are done every episode_length steps.
+    """
+
+    def __init__(self, file_name=None, worker_id=0, no_graphics=False, **simulated_config):
+
+        unknown_keys = [
+            key for key in simulated_config.keys() if key not in SIMULATED_CONFIG.keys()
+        ]
+        if len(unknown_keys) > 0:
+            error = "Unknown keys {} in simulated_config, valid keys are {}".format(
+                unknown_keys,
+                list(SIMULATED_CONFIG.keys()),
+            )
+            logger.error(error)
+            raise Exception(error)
+
+        self.config = dict(SIMULATED_CONFIG)
+        self.config.update(simulated_config)
+
+        if self.config["action_space_type"] not in VALID_ACTION_SPACE_TYPES:
+            error = "action_space_type {} in simulated_config is invalid, valid ones are {}".format(
+                self.config["action_space_type"],
+                VALID_ACTION_SPACE_TYPES,
+            )
+            logger.error(error)
+            raise Exception(error)
+
+        self.academy_name = "Simulated-{}".format(file_name)
+        self.worker_id = worker_id
+        self.random_state = np.random.RandomState(self.config["seed"])
+
+        camera_resolutions = [
+            {
+                "height": self.config["camera_height"],
+                "width": self.config["camera_width"],
+                "blackAndWhite": self.config["is_black_and_white"],
+            } for _ in range(self.config["number_cameras"])
+        ]
+        self._brains = {
+            SIMULATED_BRAIN_NAME: BrainParameters(
+                SIMULATED_BRAIN_NAME,
+                self.config["vector_observation_size"],
+                1,
+                camera_resolutions,
+                list(self.config["action_space_size"]),
+                [""] * len(self.config["action_space_size"]),
+                # BrainParameters takes the index of the action space type
+                VALID_ACTION_SPACE_TYPES.index(
+                    self.config["action_space_type"]
+                ),
+            )
+        }
+
+        self.agents = list(range(self.config["number_agents"]))
+
+        # frames[camera_i][frame_i]
+        self.frames = []
+        for _ in range(self.config["number_cameras"]):
+            frames_per_camera = []
+            for _ in range(self.config["number_frames"]):
+                frame = self.random_state.randint(
+                    0, 256,
+                    size=(self.config["camera_height"],
+                          self.config["camera_width"], 3),
+                    dtype=np.uint8,
+                )
+                if self.config["is_encode_visual"]:
+                    frame = cv2.imencode(".png", frame)[1].tobytes()
+                else:
+                    frame = frame.astype(np.float64) / 255.0
+                    if self.config["is_black_and_white"]:
+                        frame = frame.mean(axis=2, keepdims=True)
+                frames_per_camera += [frame]
+            self.frames += [frames_per_camera]
+
+        self.vector_observations = self.random_state.randn(
+            self.config["number_frames"],
+            self.config["number_agents"],
+            self.config["vector_observation_size"],
+        ).astype(np.float32)
+
+        self.step_i = 0
+
+    @property
+    def brains(self):
+        return self._brains
+
+    @property
+    def external_brain_names(self):
+        return [SIMULATED_BRAIN_NAME]
+
+    @property
+    def brain_names(self):
+        return [SIMULATED_BRAIN_NAME]
+
+    @property
+    def number_brains(self):
+        return 1
+
+    @property
+    def number_external_brains(self):
+        return 1
+
+    @property
+    def reset_parameters(self):
+        return {}
+
+    def get_brain_info(self):
+        """Get the BrainInfo of the current step, as it is received from the communicator.
+        """
+
+        frame_i = self.step_i % self.config["number_frames"]
+
+        visual_observations = []
+        for frames_per_camera in self.frames:
+            if self.config["is_encode_visual"]:
+                # decoded (or kept encoded) by BrainInfo.process_pixels, as for a game
+                visual_observations += [[
+                    BrainInfo.process_pixels(
+                        frames_per_camera[(frame_i + agent_i) % self.config["number_frames"]],
+                        self.config["is_black_and_white"],
+                    ) for agent_i in self.agents
+                ]]
+            else:
+                visual_observations += [[
+                    frames_per_camera[(frame_i + agent_i) % self.config["number_frames"]] for agent_i in self.agents
+                ]]
+
+        is_done = (self.step_i > 0) and (
+            self.step_i % self.config["episode_length"] == 0
+        )
+
+        return {
+            SIMULATED_BRAIN_NAME: BrainInfo(
+                visual_observation=visual_observations,
+                vector_observation=self.vector_observations[frame_i].copy(),
+                text_observations=[""] * len(self.agents),
+                reward=self.random_state.rand(len(self.agents)).tolist(),
+                agents=list(self.agents),
+                local_done=[is_done] * len(self.agents),
+                max_reached=[is_done] * len(self.agents),
+            )
+        }
+
+    def reset(self, config=None, train_mode=True, custom_reset_parameters=None):
+        if self.config["reset_latency"] > 0.0:
+            time.sleep(self.config["reset_latency"])
+        self.step_i = 0
+        return self.get_brain_info()
+
+    def step(self, vector_action=None, memory=None, text_action=None, value=None, custom_action=None):
+        if self.config["step_latency"] > 0.0:
+            time.sleep(self.config["step_latency"])
+        self.step_i += 1
+        return self.get_brain_info()
+
+    def close(self):
+        pass
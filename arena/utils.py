@@ -2,12 +2,17 @@ import os
 import re
 import cv2
 import io
+import math
 import logging
+import threading
 
 import platform
 import random
 import gym
 import json
+import pickle
+import hashlib
+import tempfile
 
 from PyInquirer import prompt
 from examples import custom_style_2
@@ -27,6 +32,15 @@ plt.switch_backend('agg')
 
 logger = logging.getLogger(__name__)
 
+METADATA_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "arena"
+)
+# latencies are bucketed from LATENCY_HISTOGRAM_MIN seconds, with each bucket LATENCY_HISTOGRAM_GROWTH times wider,
+# so that the quantiles of a LatencyHistogram are within a relative error of LATENCY_HISTOGRAM_GROWTH - 1
+LATENCY_HISTOGRAM_MIN = 1e-6
+LATENCY_HISTOGRAM_GROWTH = 1.05
+LATENCY_QUANTILES = [0.5, 0.95, 0.99]
+
 
 def summarize_sample_batch(sample_batch):
 
@@ -551,3 +565,135 @@ def gallery(array, ncols=3):
               .swapaxes(1, 2)
               .reshape(height * nrows, width * ncols, intensity))
     return result
+
+
+def get_metadata_cache_path(cache_name, cache_key):
+    """Get path of the cache file of cache_key, which is a dict identifying the cached metadata.
+    """
+    cache_key_str = json.dumps(cache_key, sort_keys=True, default=str)
+    return os.path.join(
+        METADATA_CACHE_DIR,
+        cache_name,
+        "{}.pkl".format(
+            hashlib.sha1(cache_key_str.encode("utf-8")).hexdigest()
+        )
+    )
+
+
+def load_metadata_cache(cache_name, cache_key):
+    """Load metadata cached by save_metadata_cache, return None if it is not cached.
+    """
+    cache_path = get_metadata_cache_path(cache_name, cache_key)
+    try:
+        with open(cache_path, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning("Load metadata cache {} failed: {}.".format(
+            cache_path,
+            e,
+        ))
+        return None
+
+
+def save_metadata_cache(cache_name, cache_key, metadata):
+    """Save metadata to the cache file of cache_key.
+    The file is written to a temporary file and moved into place, so that concurrent readers never see a partial file.
+    """
+    cache_path = get_metadata_cache_path(cache_name, cache_key)
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    temp_cache_path = None
+    try:
+        # unique to each writer, also for the threads of a process creating envs concurrently (see launch_envs)
+        fd, temp_cache_path = tempfile.mkstemp(
+            dir=os.path.dirname(cache_path),
+            suffix=".tmp",
+        )
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(metadata, f)
+        os.replace(temp_cache_path, cache_path)
+    except Exception as e:
+        logger.warning("Save metadata cache {} failed: {}.".format(
+            cache_path,
+            e,
+        ))
+        if temp_cache_path is not None:
+            try:
+                os.remove(temp_cache_path)
+            except FileNotFoundError:
+                pass
+
+
+class LatencyHistogram(object):
+    """Streaming histogram of latencies (in seconds) in logarithmic buckets,
+    which estimates quantiles without storing the latencies.
+    """
+
+    def __init__(self):
+        # bucket_i is the number of latencies in
+        # [LATENCY_HISTOGRAM_MIN * LATENCY_HISTOGRAM_GROWTH ** bucket_i, LATENCY_HISTOGRAM_MIN * LATENCY_HISTOGRAM_GROWTH ** (bucket_i + 1))
+        self.buckets = {}
+        self.count = 0
+
+    def add(self, latency):
+        bucket_i = int(
+            math.log(max(latency, LATENCY_HISTOGRAM_MIN) / LATENCY_HISTOGRAM_MIN) /
+            math.log(LATENCY_HISTOGRAM_GROWTH)
+        )
+        self.buckets[bucket_i] = self.buckets.get(bucket_i, 0) + 1
+        self.count += 1
+
+    def merge(self, other):
+        for bucket_i, count in other.buckets.items():
+            self.buckets[bucket_i] = self.buckets.get(bucket_i, 0) + count
+        self.count += other.count
+
+    def quantile(self, q):
+        """Estimate the q quantile of the latencies, None if there is no latency.
+        """
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for bucket_i in sorted(self.buckets.keys()):
+            seen += self.buckets[bucket_i]
+            if seen > rank:
+                break
+        # geometric center of the bucket
+        return LATENCY_HISTOGRAM_MIN * LATENCY_HISTOGRAM_GROWTH ** (bucket_i + 0.5)
+
+
+class LatencyTimers(object):
+    """LatencyHistogram of each named stage, which can be drained from other threads.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, latency):
+        with self.lock:
+            if name not in self.histograms.keys():
+                self.histograms[name] = LatencyHistogram()
+            self.histograms[name].add(latency)
+
+    def drain(self):
+        """Return the histograms and start new ones.
+        """
+        with self.lock:
+            histograms = self.histograms
+            self.histograms = {}
+        return histograms
+
+
+def merge_latency_histograms(histograms_to_merge):
+    """Merge a list of dicts of LatencyHistogram into a dict of LatencyHistogram, by name.
+    """
+    merged_histograms = {}
+    for histograms in histograms_to_merge:
+        for name, histogram in histograms.items():
+            if name not in merged_histograms.keys():
+                merged_histograms[name] = LatencyHistogram()
+            merged_histograms[name].merge(histogram)
+    return merged_histograms
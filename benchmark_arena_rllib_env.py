@@ -0,0 +1,236 @@
+"""Benchmark the throughput of ArenaRllibEnv (the env layer, i.e., the wrappers around the game),
+driven by the simulated backend (arena/simulated.py), across sensors, multi_agent_obs,
+is_shuffle_agents and social configs.
+
+Results are saved as a machine-readable baseline (json) with --save-baseline,
+and compared against the baseline otherwise, flagging regressions beyond --threshold.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+import time
+import json
+import argparse
+import itertools
+import logging
+import tracemalloc
+import arena
+import numpy as np
+
+from arena.envs import VALID_SENSORS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MULTI_AGENT_OBS = [
+    "own", "team_absolute", "team_relative", "all_absolute", "all_relative",
+]
+# the simulated backend only takes the number of agents and the action type from the env
+ENVS = [
+    "Arena-Tennis-Sparse-2T1P-Discrete",
+    "Arena-Blowblow-Sparse-2T2P-Discrete",
+]
+IS_SHUFFLE_AGENTS = [False, True]
+# metrics, and if a larger value is better
+METRICS = {
+    "steps_per_sec": True,
+    "resets_per_sec": True,
+    "step_alloc_bytes": False,
+}
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the env layer of Arena with the simulated backend."
+    )
+    parser.add_argument(
+        "--baseline-file", type=str, default="./benchmark_arena_rllib_env.json",
+        help="Json file of the baseline to compare against, or to save to."
+    )
+    parser.add_argument(
+        "--save-baseline", action="store_true",
+        help="Save the results as the baseline, instead of comparing against it."
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=0.2,
+        help="Relative change of a metric beyond which it is flagged as a regression."
+    )
+    parser.add_argument(
+        "--num-steps", type=int, default=1000,
+        help="Number of steps to measure steps_per_sec."
+    )
+    parser.add_argument(
+        "--num-resets", type=int, default=50,
+        help="Number of resets to measure resets_per_sec."
+    )
+    parser.add_argument(
+        "--num-alloc-steps", type=int, default=50,
+        help="Number of steps to measure step_alloc_bytes, which are slow since allocations are traced."
+    )
+    parser.add_argument(
+        "--env-config", type=json.loads, default={},
+        help="Json of additional env_config, e.g., '{\"is_reuse_obs_buffers\": true, \"obs_buffers_depth\": 4}'."
+    )
+    parser.add_argument(
+        "--filter", type=str, default="",
+        help="Only run the configs whose key contains this string."
+    )
+    return parser
+
+
+def get_config_key(env, sensor, multi_agent_ob, is_shuffle_agents):
+    return "{}-{}-{}-shuffle_{}".format(
+        env.split("-")[-2],
+        sensor,
+        multi_agent_ob,
+        is_shuffle_agents,
+    )
+
+
+def benchmark(env, env_config, args):
+    """Benchmark ArenaRllibEnv(env, env_config), return a dict of METRICS.
+    """
+
+    rllib_env = arena.ArenaRllibEnv(
+        env=env,
+        env_config=env_config,
+    )
+
+    # sample actions beforehand, so that only the env is measured
+    actions = [
+        {
+            arena.agent_i2id(agent_i): rllib_env.action_space.sample() for agent_i in range(rllib_env.number_agents)
+        } for _ in range(16)
+    ]
+
+    rllib_env.reset()
+    # warm up, e.g., the preallocated buffers
+    for step_i in range(10):
+        rllib_env.step(actions[step_i % len(actions)])
+
+    step_start = time.perf_counter()
+    for step_i in range(args.num_steps):
+        _, _, dones, _ = rllib_env.step(actions[step_i % len(actions)])
+        if dones["__all__"]:
+            rllib_env.reset()
+    steps_per_sec = args.num_steps / (time.perf_counter() - step_start)
+
+    reset_start = time.perf_counter()
+    for _ in range(args.num_resets):
+        rllib_env.reset()
+    resets_per_sec = args.num_resets / (time.perf_counter() - reset_start)
+
+    # the peak of the memory allocated by a step, which is what tracemalloc traces since it starts
+    step_alloc_bytes = []
+    for step_i in range(args.num_alloc_steps):
+        tracemalloc.start()
+        _, _, dones, _ = rllib_env.step(actions[step_i % len(actions)])
+        step_alloc_bytes += [tracemalloc.get_traced_memory()[1]]
+        tracemalloc.stop()
+        if dones["__all__"]:
+            rllib_env.reset()
+
+    rllib_env.close()
+
+    return {
+        "steps_per_sec": steps_per_sec,
+        "resets_per_sec": resets_per_sec,
+        "step_alloc_bytes": float(np.mean(step_alloc_bytes)),
+    }
+
+
+def get_regressions(results, baseline, threshold):
+    """Compare results against baseline, return a list of (config_key, metric, result, baseline).
+    """
+    regressions = []
+    for config_key, metrics in results.items():
+        if config_key not in baseline.keys():
+            continue
+        for metric, is_larger_better in METRICS.items():
+            if is_larger_better:
+                is_regressed = metrics[metric] < baseline[config_key][metric] * (
+                    1.0 - threshold
+                )
+            else:
+                is_regressed = metrics[metric] > baseline[config_key][metric] * (
+                    1.0 + threshold
+                )
+            if is_regressed:
+                regressions += [(
+                    config_key, metric, metrics[metric], baseline[config_key][metric]
+                )]
+    return regressions
+
+
+def run(args):
+
+    results = {}
+    for env, sensor, multi_agent_ob, is_shuffle_agents in itertools.product(
+        ENVS, VALID_SENSORS, MULTI_AGENT_OBS, IS_SHUFFLE_AGENTS
+    ):
+        config_key = get_config_key(
+            env, sensor, multi_agent_ob, is_shuffle_agents
+        )
+        if args.filter not in config_key:
+            continue
+
+        env_config = {
+            "backend": "simulated",
+            "sensors": [sensor],
+            "multi_agent_obs": [multi_agent_ob],
+            "is_shuffle_agents": is_shuffle_agents,
+            "train_mode": True,
+        }
+        env_config.update(args.env_config)
+
+        results[config_key] = benchmark(env, env_config, args)
+        logger.info("{}: {:.1f} steps/sec, {:.1f} resets/sec, {:.0f} bytes allocated/step".format(
+            config_key,
+            results[config_key]["steps_per_sec"],
+            results[config_key]["resets_per_sec"],
+            results[config_key]["step_alloc_bytes"],
+        ))
+
+    if args.save_baseline:
+        with open(args.baseline_file, "w") as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+        logger.info("Saved baseline to {}".format(args.baseline_file))
+        return 0
+
+    if not os.path.exists(args.baseline_file):
+        logger.warning(
+            "Baseline {} does not exist, run with --save-baseline to create it.".format(
+                args.baseline_file,
+            )
+        )
+        return 0
+
+    with open(args.baseline_file, "r") as f:
+        baseline = json.load(f)
+
+    regressions = get_regressions(results, baseline, args.threshold)
+    for config_key, metric, result, baseline_result in regressions:
+        logger.error("Regression at {}: {} is {:.1f}, baseline is {:.1f}".format(
+            config_key,
+            metric,
+            result,
+            baseline_result,
+        ))
+    if len(regressions) > 0:
+        return 1
+
+    logger.info("No regression beyond {:.0%} against {}".format(
+        args.threshold,
+        args.baseline_file,
+    ))
+    return 0
+
+
+if __name__ == "__main__":
+    parser = create_parser()
+    args = parser.parse_args()
+    sys.exit(run(args))